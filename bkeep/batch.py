@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+
+import os, sys, csv, json, datetime, argparse, hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .bkeep import Bkeep, pathtract, dtstr, strdt
+
+###
+###     複数の帳簿の一括処理
+###
+
+# 集計する期間の種類 (Bkeep の期間作成のメソッド)
+PERIODS = {"month" : "mkMonth", "week" : "mkSpan", "year" : "mkYear"}
+
+def readmanifest(path):
+    """ 帳簿の一覧 (json) を読み込み、{"name", "input", "output"} の
+    dict のリストを返す
+    一覧は {"input" : ..., "output" : ..., ("name" : ...)} もしくは
+    [input, output] のリストとし、相対パスは一覧のファイルからのパスとする
+    name を省略した場合は input のディレクトリ名とする """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, "r", encoding="utf-8") as rf:
+        books = json.load(rf)
+    rslt = []
+    for x in books:
+        if not isinstance(x, dict):
+            x = {"input" : x[0], "output" : x[1]}
+        inp = os.path.join(base, x["input"])
+        rslt.append({
+            "name" : x.get("name", os.path.basename(os.path.normpath(inp))),
+            "input" : inp,
+            "output" : os.path.join(base, x["output"])
+        })
+
+    # name は集計結果の行の見出しとなるため、重複を許さない
+    names = [x["name"] for x in rslt]
+    if len(set(names)) != len(names):
+        raise ValueError("Duplicated book names in " + path)
+    return rslt
+
+def book(task):
+    """ 1 つの帳簿の仕訳・転記と出力
+    task は readmanifest の dict に "end", "period", "checkpoint" を
+    加えたもの (プロセスプールで実行するため、モジュールの関数とする)
+    ledger.json, journal.csv, fs{Monthly,Weekly,Yearly}.csv と cat.txt
+    を output に保存し、期間ごとの [name, start, end, earn, epi] の
+    リストを返す """
+
+    inp, out = task["input"], task["output"]
+    os.makedirs(out, exist_ok=True)
+    inpdict, adjdict = pathtract(inp, "bk"), pathtract(inp, "adj")
+    start = min(inpdict.keys())
+    end = task["end"] or max(inpdict.keys())
+
+    # 仕訳・転記
+    bk = Bkeep(os.path.join(inp, "init.json"), start)
+    if task["checkpoint"]:
+        bk.update(inpdict, adjdict, os.path.join(out, "checkpoint.json"))
+    else:
+        bk.journalize(inpdict)
+        bk.journalize(adjdict, adj=True)
+        bk.post()
+    bk.write_ledger(os.path.join(out, "ledger.json"))
+    bk.write_journal(os.path.join(out, "journal.csv"))
+
+    # 期間ごとの csv データ
+    names = {"month" : "Monthly", "week" : "Weekly", "year" : "Yearly"}
+    spans = {
+        names[x] : getattr(bk, PERIODS[x])(start, end)
+        for x in ("month", "week", task["period"])
+    }
+    spans = bk.calcSpans(spans)
+    for name, fs in spans.items():
+        bk.saveSpan(os.path.join(out, "fs%s.csv" % name), fs=fs)
+
+    # 当月の財務諸表
+    bk.prepare(datetime.date(end.year, end.month, 1), end)
+    bk.make()
+    bk.cat(os.path.join(out, "cat.txt"))
+
+    # 期間ごとの earn, epi
+    rows = bk.iter_span_rows(spans[names[task["period"]]])
+    next(rows)
+    return [
+        [task["name"], dtstr(x[0]), dtstr(x[1]), x[2], x[3]] for x in rows
+    ]
+
+def initkey(task):
+    """ task の init.json の sha1 (同じ内容の帳簿を続けて処理するため)
+    読み込めない場合は "" とし、エラーは book の中で報告する """
+    try:
+        with open(os.path.join(task["input"], "init.json"), "rb") as rf:
+            return hashlib.sha1(rf.read()).hexdigest()
+    except OSError:
+        return ""
+
+def run(books, summary, end=None, period="month", checkpoint=False,
+        workers=None):
+    """ books (readmanifest の返り値) の各帳簿を workers 個のプロセスで
+    処理し、期間ごとの earn, epi を summary (csv) にまとめる
+    init.json の内容が同じ帳簿は続けて処理し、勘定科目の階層を
+    プロセス内で共有する
+    {name : 例外} (失敗した帳簿) を返す """
+
+    tasks = [
+        dict(x, end=end, period=period, checkpoint=checkpoint)
+        for x in books
+    ]
+    tasks.sort(key=initkey)
+
+    results, errors = {}, {}
+    if workers == 1:
+        for task in tasks:
+            try:
+                results[task["name"]] = book(task)
+            except Exception as e:
+                errors[task["name"]] = e
+    else:
+        with ProcessPoolExecutor(workers) as ex:
+            futures = {ex.submit(book, x) : x["name"] for x in tasks}
+            for f in as_completed(futures):
+                try:
+                    results[futures[f]] = f.result()
+                except Exception as e:
+                    errors[futures[f]] = e
+
+    # 一覧の順に集計結果を保存
+    with open(summary, "w", encoding="utf-8") as wf:
+        writer = csv.writer(wf)
+        writer.writerow(["book", "start", "end", "earn", "epi"])
+        for x in books:
+            writer.writerows(results.get(x["name"], []))
+
+    return errors
+
+
+###
+###     コマンドライン
+###
+
+def main(argv=None):
+    """ 帳簿の一覧を一括処理し、earn, epi の集計を csv で保存する """
+
+    p = argparse.ArgumentParser(
+        prog="bkeep-batch",
+        description="run bkeep for many books in parallel"
+    )
+    p.add_argument("manifest",
+                   help=r"json list of {input, output, (name)} or [input, output]")
+    p.add_argument("--summary", "-s", default="summary.csv",
+                   help=r"where to write earn/epi of every book (default: summary.csv)")
+    p.add_argument("--endpoint", "-p", default=None,
+                   help=r"calculation end point, YYYYMMDD (default: last bk file)")
+    p.add_argument("--period", choices=list(PERIODS.keys()), default="month",
+                   help=r"period of the summary (default: month)")
+    p.add_argument("--checkpoint", "-k", action="store_true", default=False,
+                   help=r"reuse checkpoint.json in each output dir")
+    p.add_argument("--jobs", "-j", type=int, default=None,
+                   help=r"number of processes (default: number of cpus)")
+    args = p.parse_args(argv)
+
+    errors = run(
+        readmanifest(args.manifest), args.summary,
+        strdt(args.endpoint) if args.endpoint else None,
+        args.period, args.checkpoint, args.jobs
+    )
+    for name, e in errors.items():
+        print("bkeep-batch: %s: %s: %s" % (name, type(e).__name__, e),
+              file=sys.stderr)
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+
+import os, sys, json, time, random, datetime, argparse, tempfile, shutil
+import platform, tracemalloc
+from .bkeep import Bkeep, pathtract, dtstr, strdt
+
+try:
+    import resource
+except ImportError:     # Windows など
+    resource = None
+
+###
+###     合成データの作成
+###
+
+# 要素ごとの勘定名の接頭辞 (最終項目名が要素間で重複しないようにする)
+PREFIX = {
+    "assets" : "a", "liabilities" : "l", "equity" : "q",
+    "income" : "r", "expenses" : "x"
+}
+
+def mknames(prefix, width, depth):
+    """ prefix の勘定について、各階層 width 個、depth 階層の
+    a:b:c 形式の勘定名のリストを返す
+    (各階層の項目名は prefix と位置の番号からなり、一意となる) """
+    names = [[]]
+    for i in range(depth):
+        names = [x + [j] for x in names for j in range(width)]
+    return [
+        ":".join(prefix + "_".join(map(str, x[:k+1])) for k in range(depth))
+        for x in names
+    ]
+
+def mkinitial(width=3, depth=3):
+    """ 合成データ用の initial data を返す
+    equity には retained のみを置き、assets の合計と一致させる """
+    initial = {
+        elem : {x : 0 for x in mknames(prefix, width, depth)}
+        for elem, prefix in PREFIX.items() if elem != "equity"
+    }
+    for i, x in enumerate(initial["assets"].keys()):
+        initial["assets"][x] = 10000 * (i + 1)
+    initial["equity"] = {"retained" : sum(initial["assets"].values())}
+    return {elem : initial[elem] for elem in PREFIX.keys()}
+
+def generate(path, start, years=1, rows=20, adjrows=5, width=3, depth=3,
+             seed=0):
+    """ path に init.json と start から years 年分の bk ファイル
+    (1 日 rows 行)、adj ファイル (1 月 adjrows 行) を作成する
+    {"days" : bk ファイル数, "months" : adj ファイル数,
+     "entries" : 仕訳の行数, "accounts" : 勘定数} を返す """
+
+    rnd = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    initial = mkinitial(width, depth)
+    with open(os.path.join(path, "init.json"), "w") as wf:
+        json.dump(initial, wf, indent=4)
+
+    # 最終項目名 (bk ファイルでの省略形)
+    leaf = {
+        elem : [x.split(":")[-1] for x in initial[elem].keys()]
+        for elem in initial.keys()
+    }
+
+    # 費用は assets か liabilities から、収益は assets へ
+    def entry(i):
+        v = rnd.randint(100, 50000)
+        if i % 10 == 0:
+            Dr, Cr = rnd.choice(leaf["assets"]), rnd.choice(leaf["income"])
+        else:
+            Dr = rnd.choice(leaf["expenses"])
+            Cr = rnd.choice(leaf["assets"] + leaf["liabilities"])
+        return "%s,%d,%s,%d # item %d" % (Dr, v, Cr, v, i)
+
+    end = datetime.date(start.year + years, start.month, start.day)
+    day, stats = start, {"days" : 0, "months" : 0, "entries" : 0}
+    while day < end:
+        name = os.path.join(path, "bk%s.txt" % dtstr(day))
+        with open(name, "w") as wf:
+            wf.write("\n".join(entry(i) for i in range(rows)) + "\n")
+        stats["days"] += 1
+        stats["entries"] += rows
+        if day.day == 1 and adjrows:
+            name = os.path.join(path, "adj%s.txt" % day.strftime("%Y%m"))
+            with open(name, "w") as wf:
+                wf.write("\n".join(entry(i + 1) for i in range(adjrows)) + "\n")
+            stats["months"] += 1
+            stats["entries"] += adjrows
+        day += datetime.timedelta(days=1)
+
+    stats["accounts"] = sum(len(x) for x in initial.values())
+    return stats
+
+
+###
+###     計測
+###
+
+class Bench:
+    """ 各段階の所要時間・処理件数・メモリ使用量を記録するクラス
+    trace=True の場合、tracemalloc による段階ごとのピークも記録する
+    (tracemalloc は処理を遅くするため、既定では最大 RSS のみ) """
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.stages = []
+
+    def measure(self, name, func, *args, items=None, **kwargs):
+        """ func(*args, **kwargs) を実行して計測し、返り値を返す
+        items は処理件数 (もしくは返り値から件数を返す関数) """
+
+        if self.trace:
+            tracemalloc.start()
+        t = time.perf_counter()
+        rslt = func(*args, **kwargs)
+        sec = time.perf_counter() - t
+
+        stage = {"stage" : name, "seconds" : round(sec, 6)}
+        n = items(rslt) if callable(items) else items
+        if n is not None:
+            stage["items"] = n
+            stage["per_sec"] = round(n / sec, 1) if sec else None
+        if self.trace:
+            stage["peak_kb"] = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+        stage["maxrss_kb"] = maxrss()
+        self.stages.append(stage)
+        return rslt
+
+    def report(self, **params):
+        """ params と各段階の結果からなる dict を返す """
+        return {
+            "params" : params,
+            "python" : platform.python_version(),
+            "stages" : self.stages,
+            "total_seconds" : round(sum(x["seconds"] for x in self.stages), 6),
+            "maxrss_kb" : maxrss()
+        }
+
+def maxrss():
+    """ プロセスの最大 RSS (KB) を返す (取得できない場合は None) """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+def count(bk):
+    """ bk の元帳の行数を返す """
+    return sum(len(x) for elem in bk.ledger.values() for x in elem.values())
+
+def run(path, output, trace=False, workers=None, format="json",
+        columnar=False, engine="python"):
+    """ path の合成データ (generate で作成) について、各段階を計測し、
+    Bench.report の dict を返す (output には ledger などを出力する) """
+
+    bench = Bench(trace)
+    measure = bench.measure
+
+    # bk ファイルの列挙
+    inpdict = measure("pathtract", pathtract, path, "bk", items=len)
+    adjdict = measure("pathtract_adj", pathtract, path, "adj", items=len)
+    start, end = min(inpdict.keys()), max(inpdict.keys())
+
+    # 仕訳・転記
+    # (各段階の計算を計測するため、試算表・財務諸表はキャッシュしない)
+    bk = Bkeep(
+        os.path.join(path, "init.json"), start,
+        columnar=columnar, engine=engine, cachesize=0
+    )
+    entries = lambda _: sum(len(x) for x in bk.journal.values())
+    measure("journalize", bk.journalize, inpdict, workers=workers,
+            items=entries)
+    n = entries(None)
+    measure("journalize_adj", bk.journalize, adjdict, adj=True,
+            workers=workers, items=lambda _: entries(None) - n)
+    measure("post", bk.post, items=lambda _: count(bk))
+
+    # 元帳の保存・読み込み
+    ext = {"json" : "json", "binary" : "bkl", "sqlite" : "db"}[format]
+    ledger = os.path.join(output, "ledger." + ext)
+    measure("write_ledger", bk.write_ledger, ledger, items=count(bk))
+    measure("read_ledger", bk.read_ledger, ledger, items=lambda _: count(bk))
+
+    # 月次・週次の計算と保存
+    months, weeks = list(bk.mkMonth(start, end)), list(bk.mkSpan(start, end))
+    monthly = measure("calcSpan_monthly", bk.calcSpans, {"Monthly" : months},
+                      items=len(months))["Monthly"]
+    measure("calcSpan_weekly", bk.calcSpans, {"Weekly" : weeks},
+            items=len(weeks))
+    measure("saveSpan", bk.saveSpan, os.path.join(output, "fsMonthly.csv"),
+            fs=monthly, items=len(months))
+
+    # 試算表と FS の作成・出力
+    def statement():
+        bk.prepare(datetime.date(end.year, end.month, 1), end)
+        bk.make()
+        bk.cat(os.path.join(output, "cat.txt"))
+    measure("make_cat", statement, items=1)
+
+    return bench.report(
+        path=path, start=dtstr(start), end=dtstr(end), workers=workers,
+        format=format, columnar=columnar, engine=engine, trace=trace
+    )
+
+
+###
+###     コマンドライン
+###
+
+def main(argv=None):
+    """ 合成データを作成して計測し、結果を json で出力する """
+
+    p = argparse.ArgumentParser(
+        prog="bkeep-bench",
+        description="benchmark bkeep on a synthetic book"
+    )
+    p.add_argument("--input", "-i", default=None,
+                   help=r"work directory, reuse its input/ if it exists")
+    p.add_argument("--keep", action="store_true", default=False,
+                   help=r"keep the generated data and outputs")
+    p.add_argument("--start", default="20200101",
+                   help=r"first day of the synthetic book, YYYYMMDD")
+    p.add_argument("--years", type=int, default=3,
+                   help=r"years of daily bk files (default: 3)")
+    p.add_argument("--rows", type=int, default=20,
+                   help=r"entries per bk file (default: 20)")
+    p.add_argument("--adjrows", type=int, default=5,
+                   help=r"entries per monthly adj file (default: 5)")
+    p.add_argument("--width", type=int, default=3,
+                   help=r"accounts per hierarchy level (default: 3)")
+    p.add_argument("--depth", type=int, default=3,
+                   help=r"depth of a:b:c account hierarchy (default: 3)")
+    p.add_argument("--seed", type=int, default=0,
+                   help=r"random seed (default: 0)")
+    p.add_argument("--jobs", "-j", type=int, default=None,
+                   help=r"number of processes to read bk/adj files")
+    p.add_argument("--format", "-f", default="json",
+                   choices=["json", "binary", "sqlite"],
+                   help=r"ledger file format (default: json)")
+    p.add_argument("--columnar", action="store_true", default=False,
+                   help=r"keep the ledger as typed arrays")
+    p.add_argument("--engine", choices=["python", "numpy"], default="python",
+                   help=r"engine for span calculations (default: python)")
+    p.add_argument("--tracemalloc", action="store_true", default=False,
+                   help=r"record per-stage peak memory with tracemalloc")
+    p.add_argument("--json", default=None,
+                   help=r"write the report to this file (default: stdout)")
+    args = p.parse_args(argv)
+
+    # 作業ディレクトリ (--input の指定がなければ一時ディレクトリ)
+    work = args.input or tempfile.mkdtemp(prefix="bkeep-bench-")
+    path, output = os.path.join(work, "input"), os.path.join(work, "output")
+    os.makedirs(output, exist_ok=True)
+
+    try:
+        # 合成データの作成 (既存のデータがあれば再利用)
+        if os.path.isfile(os.path.join(path, "init.json")):
+            stats = None
+        else:
+            t = time.perf_counter()
+            stats = generate(
+                path, strdt(args.start), args.years, args.rows, args.adjrows,
+                args.width, args.depth, args.seed
+            )
+            stats["seconds"] = round(time.perf_counter() - t, 6)
+
+        rslt = run(
+            path, output, args.tracemalloc, args.jobs, args.format,
+            args.columnar, args.engine
+        )
+        rslt["generate"] = stats
+    finally:
+        if not (args.keep or args.input):
+            shutil.rmtree(work)
+
+    # 結果の出力
+    if args.json:
+        with open(args.json, "w") as wf:
+            json.dump(rslt, wf, indent=4)
+    else:
+        json.dump(rslt, sys.stdout, indent=4)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,20 @@
 # -*- coding: utf-8 -*-
 
-import sys, os, re, copy, csv, json, datetime
-from collections import OrderedDict as od
+import sys, os, re, copy, csv, json, datetime, bisect, hashlib, mmap, struct
+import time, tracemalloc, gzip, calendar, zipfile
+from array import array
+from functools import partial, wraps, lru_cache
+from operator import itemgetter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from .store import Store
+from collections import OrderedDict as od, namedtuple
+from collections.abc import MutableMapping
+
+# numpy は任意 (engine="numpy" の場合のみ利用する)
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 ###
 ###     エイリアス
@@ -17,19 +30,35 @@ getcmt = lambda x: cmt.search(x).group(1).strip()
 # コメントの削除
 rmcmt = lambda x: cmt.sub("", x).strip()
 
+###
+###     日付
+###
+
+# 日付の変換は行ごとに繰り返されるため、結果を記憶する
+# (同じ日付には同じ datetime.date のオブジェクトを返す)
+
 # datetime.date 型を文字列に変換
-dtstr = lambda x: x.strftime("%Y%m%d")
+dtstr = lru_cache(maxsize=None)(lambda x: x.strftime("%Y%m%d"))
 
 # 文字列日付を datetime.date 型に変換
-strdt = lambda x: datetime.date(int(x[:4]), int(x[4:6]), int(x[6:]))
+strdt = lru_cache(maxsize=None)(
+    lambda x: datetime.date(int(x[:4]), int(x[4:6]), int(x[6:]))
+)
+
+# 序数 (toordinal) を datetime.date 型、文字列日付に変換
+fromord = lru_cache(maxsize=None)(datetime.date.fromordinal)
+ordstr = lru_cache(maxsize=None)(lambda x: dtstr(fromord(x)))
+
+# 月末日の表
+@lru_cache(maxsize=None)
+def monthend(year, month):
+    """ year 年 month 月の月末日を返す """
+    return datetime.date(year, month, calendar.monthrange(year, month)[1])
 
 # 月末日の計算
 def maxday(x):
     """ datetime.date を指定すると、その月の月末日を返す """
-    try:
-        return maxday(datetime.date(x.year, x.month, x.day + 1))
-    except:
-        return x
+    return monthend(x.year, x.month)
 
 # datetime と ファイル名の組み合わせの作成
 # ファイル名からなる iterable を受け取り、dict を返す
@@ -63,35 +92,827 @@ def pathtract(path, match):
     files = (opj(path, x) for x in ol(path) if re.match(match, x))
     return mkfiledict(files)
 
+# 仕訳データの整形
+def alignjnl(data, names):
+    """ 仕訳データの金額部分について、コメントを除き、整数化する
+    names は省略形 (最終項目名のみ) から正式名称への dict """
+    for Dname, Damount, Cname, Camount in data:
+        comment = getcmt(Camount) if cmt.search(Camount) else ""
+        Camount = rmcmt(Camount)
+        Damount = int(Damount) if Dname else 0
+        Camount = int(Camount) if Cname else 0
+        Dname = names[Dname] if Dname else ""
+        Cname = names[Cname] if Cname else ""
+        yield Dname, Damount, Cname, Camount, comment
+
+# bk ファイルや adj ファイルの読み込み
+def readjnl(path, names, encoding="utf-8"):
+    """ path の csv データを読み込み、借方勘定、借方金額、貸方勘定、
+    貸方金額、コメントのタプルのリストを返す
+    (journalize の並列処理のため、モジュールの関数とする) """
+    with open(path, "r", encoding=encoding, newline="") as rf:
+        return list(alignjnl(csv.reader(rf), names))
+
+# ファイルの同一性の判定に用いる情報
+def filestat(path, old=None):
+    """ path の [サイズ, 更新時刻, sha1] を返す
+    old (以前の filestat) とサイズ・更新時刻が一致する場合は、
+    ハッシュの計算を省略して old を返す """
+    st = os.stat(path)
+    if old and old[:2] == [st.st_size, st.st_mtime]:
+        return old
+    with open(path, "rb") as rf:
+        digest = hashlib.sha1(rf.read()).hexdigest()
+    return [st.st_size, st.st_mtime, digest]
+
+# ファイルの内容の同一性
+def samefile(old, new):
+    """ filestat を末尾に持つ一覧の要素 old, new (None は存在しない) の
+    サイズ・更新時刻以外 (種類, 日付, sha1) が一致するかを返す
+    (更新時刻のみ変わったファイルは、同じ内容とみなす) """
+    if old is None or new is None:
+        return old is new
+    return old[:-3] + old[-1:] == new[:-3] + new[-1:]
+
+# json.dump の default
+def jsondefault(x):
+    """ datetime.date は文字列日付、Columns などは tojson の値とする """
+    return dtstr(x) if isinstance(x, datetime.date) else x.tojson()
+
+# 書き出し用のファイル
+def openw(path, encoding="utf-8"):
+    """ path を書き込み用に開く (拡張子が .gz ならば gzip で圧縮する) """
+    if path.endswith(".gz"):
+        return gzip.open(path, "wt", encoding=encoding)
+    return open(path, "w", encoding=encoding)
+
+# 日割計算 (schedule) 行の合計
+def schedsum(row, start=None, end=None):
+    """ ledger の schedule 行
+    [開始日, 対照勘定, 日割額, コメント, 終了日, 最終日の金額]
+    について、start -- end (None は制限なし) に含まれる金額の合計を返す
+    終了日より前の各日は日割額、終了日は最終日の金額とする """
+    s = row[0] if start is None or start < row[0] else start
+    e = row[4] if end is None or end > row[4] else end
+    if s > e:
+        return 0
+    elif e == row[4]:
+        return (e - s).days * row[2] + row[5]
+    else:
+        return ((e - s).days + 1) * row[2]
+
+# schedule 行の日ごとの行への展開
+def dailyrows(rows):
+    """ 元帳の勘定の行 rows の schedule 行を日ごとの行
+    [日付, 対照勘定, 金額, コメント] に展開し、日付順のリストを返す
+    (ledger.json を schedule 行を知らない処理でも読めるようにする) """
+    one, daily = datetime.timedelta(days=1), []
+    for x in rows:
+        if len(x) > 4:
+            daily.extend(
+                [x[0] + i * one, x[1], x[2], x[3]]
+                for i in range((x[4] - x[0]).days)
+            )
+            daily.append([x[4], x[1], x[5], x[3]])
+        else:
+            daily.append(list(x))
+    daily.sort(key=itemgetter(0))
+    return daily
+
+# end までの行の切り出し
+def cutrows(rows, end):
+    """ 元帳の勘定の行 rows のうち end までの行のリストを返す
+    end をまたぐ schedule 行は end を終了日とし、end の金額は日割額とする """
+    rslt = []
+    for x in rows:
+        if x[0] > end:
+            continue
+        elif len(x) > 4 and x[4] > end:
+            rslt.append([x[0], x[1], x[2], x[3], end, x[2]])
+        else:
+            rslt.append(list(x))
+    return rslt
+
+
+###
+###     日割計算の仕訳
+###
+
+class Schedule(namedtuple("Schedule", (
+        "Dname", "Damount", "Cname", "Camount", "comment",
+        "end", "Dlast", "Clast"))):
+    """ adj ファイルの 1 行を日割計算した仕訳
+    先頭の 5 要素は通常の仕訳と同じく開始日 (journal の key) の仕訳で、
+    開始日から end の前日までは毎日同じ金額、end には
+    Dlast, Clast の金額を仕訳したものとみなす """
+
+    __slots__ = ()
+
+    def days(self, start):
+        """ start から end までの日ごとの仕訳を返す """
+        one = datetime.timedelta(days=1)
+        while start < self.end:
+            yield start, tuple(self[:5])
+            start += one
+        yield self.end, (self.Dname, self.Dlast,
+                         self.Cname, self.Clast, self.comment)
+
+
+###
+###     列指向の元帳
+###
+
+class Strings(list):
+    """ 勘定科目名やコメントを重複なく保持する文字列表
+    intern で文字列の番号を返す """
+
+    def __init__(self):
+        super().__init__()
+        self._ids = {}
+
+    def intern(self, x):
+        """ x の番号を返す (未登録ならば追加する) """
+        i = self._ids.get(x)
+        if i is None:
+            i = self._ids[x] = len(self)
+            self.append(x)
+        return i
+
+
+class Columns:
+    """ 1 つの勘定の元帳を型付き配列の列として保持するクラス
+    日付 (date, end) は序数 (toordinal)、金額 (amount, last) は int64、
+    対照勘定・コメントは Strings の番号とする
+    通常の行は end を 0 とし、schedule 行は end, last を持つ
+    [日付, 対照勘定, 金額, コメント (, 終了日, 最終日の金額)] のリストとして
+    参照・追加できるため、従来の元帳 (行のリスト) と同様に扱える
+    各列は memoryview (snapshot の mmap) でもよく、変更時に array に複製する """
+
+    # 列名と型 (snapshot ではこの順に格納する)
+    COLS = (("amount", "q"), ("last", "q"), ("date", "i"),
+            ("end", "i"), ("contrast", "I"), ("comment", "I"))
+
+    def __init__(self, strings, rows=(), **cols):
+        self.strings = strings
+        for name, code in self.COLS:
+            setattr(self, name, cols.get(name, array(code)))
+        self._shared = bool(cols)
+        self.extend(rows)
+
+    def __len__(self):
+        return len(self.date)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = i + len(self) if i < 0 else i
+        row = [fromord(self.date[i]), self.strings[self.contrast[i]],
+               self.amount[i], self.strings[self.comment[i]]]
+        if self.end[i]:
+            row.extend([fromord(self.end[i]), self.last[i]])
+        return row
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def _own(self):
+        """ memoryview の列を array に複製する """
+        for name, code in self.COLS:
+            setattr(self, name, array(code, getattr(self, name)))
+        self._shared = False
+
+    def append(self, row):
+        """ 行を追加する """
+        if self._shared:
+            self._own()
+        self.date.append(row[0].toordinal())
+        self.contrast.append(self.strings.intern(row[1]))
+        self.amount.append(row[2])
+        self.comment.append(self.strings.intern(row[3]))
+        self.end.append(row[4].toordinal() if len(row) > 4 else 0)
+        self.last.append(row[5] if len(row) > 4 else 0)
+
+    def extend(self, rows):
+        """ 複数の行を追加する """
+        for x in rows:
+            self.append(x)
+
+    def clear(self):
+        """ 全ての行を削除する """
+        if self._shared:
+            self._own()
+        for x in (self.date, self.end, self.amount,
+                  self.last, self.contrast, self.comment):
+            del x[:]
+
+    def sort(self, key=None, reverse=False):
+        """ list.sort と同様に行を並べ替える """
+        rows = sorted(self, key=key, reverse=reverse)
+        self.clear()
+        self.extend(rows)
+
+    def sortdate(self):
+        """ 日付の順に (同じ日付の行は元の順のまま) 列を並べ替える
+        (sort(key=itemgetter(0)) と同じ結果を、行を作らずに得る) """
+        order = sorted(range(len(self)), key=self.date.__getitem__)
+        if all(i == j for i, j in enumerate(order)):
+            return
+        self._select(order)
+
+    def drop(self, dates):
+        """ 日付が dates (datetime.date の集合) に含まれる行を削除し、
+        削除した行数を返す """
+        ords = {x.toordinal() for x in dates}
+        keep = [i for i, dt in enumerate(self.date) if dt not in ords]
+        n = len(self) - len(keep)
+        if n:
+            self._select(keep)
+        return n
+
+    def _select(self, rows):
+        """ 行番号のリスト rows の行のみからなる列とする """
+        for name, code in self.COLS:
+            col = getattr(self, name)
+            setattr(self, name, array(code, [col[i] for i in rows]))
+        self._shared = False
+
+    def split(self):
+        """ 通常の行の日付ごとの合計 {datetime.date : 金額} と、
+        schedule 行のリストを返す (_Index 用) """
+        daily = {}
+        for dt, amount, end in zip(self.date, self.amount, self.end):
+            if not end:
+                daily[dt] = daily.get(dt, 0) + amount
+        daily = {fromord(dt) : v for dt, v in daily.items()}
+        scheds = [self[i] for i, end in enumerate(self.end) if end]
+        return daily, scheds
+
+    def tojson(self):
+        """ 日付を文字列とした行のリストを返す (json.dump の default 用) """
+        strings, rslt = self.strings, []
+        for dt, contrast, amount, comment, end, last in zip(
+                self.date, self.contrast, self.amount, self.comment,
+                self.end, self.last):
+            x = [ordstr(dt), strings[contrast], amount, strings[comment]]
+            if end:
+                x.extend([ordstr(end), last])
+            rslt.append(x)
+        return rslt
+
+
+###
+###     元帳のバイナリ形式 (snapshot)
+###
+
+# magic, version, ヘッダ (json) の長さ
+SNAPHEAD = struct.Struct("<4sII")
+SNAPMAGIC, SNAPVERSION = b"BKLG", 1
+
+def _dumpcols(path, magic, version, header, cols):
+    """ snapshot, span ファイルの共通の書き出し
+    magic, version とヘッダ (header に byteorder を加えた json) の後に、
+    cols の各列 (array もしくは memoryview) を 8 バイト境界から連結して
+    path に保存する
+    (mmap 中のファイルを壊さないよう、一時ファイルを置き換える) """
+    header = json.dumps(
+        dict(byteorder=sys.byteorder, **header), ensure_ascii=False
+    ).encode("utf-8")
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as wf:
+        wf.write(SNAPHEAD.pack(magic, version, len(header)))
+        wf.write(header)
+        wf.write(b"\0" * (-wf.tell() % 8))
+        for x in cols:
+            wf.write(x)
+    os.replace(tmp, path)
+
+def _loadcols(path, magic, version, kind, use_mmap=True):
+    """ _dumpcols で保存した path を読み込み、ヘッダ (dict) と、
+    列を先頭から順に切り出す関数 take(型, 要素数) を返す
+    use_mmap=True の場合、列は mmap 上の memoryview となる (複製しない)
+    バイト順が異なる場合は複製して変換する """
+
+    with open(path, "rb") as rf:
+        if use_mmap:
+            buf = mmap.mmap(rf.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buf = rf.read()
+    head = SNAPHEAD.unpack_from(buf)
+    if head[:2] != (magic, version):
+        raise ValueError("%s isn't a bkeep %s." % (path, kind))
+    pos = SNAPHEAD.size
+    header = json.loads(bytes(buf[pos:pos + head[2]]).decode("utf-8"))
+    pos += head[2] + (-(pos + head[2]) % 8)
+
+    view, swap = memoryview(buf), header["byteorder"] != sys.byteorder
+    def take(code, n):
+        nonlocal pos
+        size = array(code).itemsize * n
+        col = view[pos:pos + size].cast(code)
+        pos += size
+        if swap:
+            col = array(code, col)
+            col.byteswap()
+        return col
+    return header, take
+
+def dumpledger(ledger, path):
+    """ ledger (行のリストもしくは Columns からなる dict) を snapshot
+    として path に保存する
+    ヘッダ (json) に文字列表と勘定ごとの行数を格納し、その後に
+    Columns.COLS の各列を全勘定分連結して (8 バイト境界から) 格納する """
+
+    # 文字列表を共有する Columns への変換
+    # (Columns の勘定があれば、その文字列表を用い、同じ文字列表の
+    # Columns は変換せずにそのまま書き出す)
+    strings = next((
+        x.strings for elem in ledger.values() for x in elem.values()
+        if isinstance(x, Columns)
+    ), None) or Strings()
+    accs = []
+    for elem in ledger.keys():
+        for ac in ledger[elem].keys():
+            x = ledger[elem][ac]
+            if not (isinstance(x, Columns) and x.strings is strings):
+                x = Columns(strings, x)
+            accs.append((elem, ac, x))
+
+    _dumpcols(path, SNAPMAGIC, SNAPVERSION, {
+        "strings" : strings,
+        "accounts" : [[elem, ac, len(x)] for elem, ac, x in accs]
+    }, (getattr(x, name) for name, code in Columns.COLS for _, _, x in accs))
+
+def loadledger(path, use_mmap=True):
+    """ snapshot を読み込み、Columns からなる ledger と文字列表を返す
+    use_mmap=True の場合、各列は mmap 上の memoryview となる (複製しない) """
+
+    header, take = _loadcols(
+        path, SNAPMAGIC, SNAPVERSION, "ledger snapshot", use_mmap
+    )
+    strings = Strings()
+    for x in header["strings"]:
+        strings.intern(x)
+
+    # 列ごとに、各勘定の範囲を切り出す
+    cols = [{} for _ in header["accounts"]]
+    for name, code in Columns.COLS:
+        for i, (elem, ac, rows) in enumerate(header["accounts"]):
+            cols[i][name] = take(code, rows)
+
+    ledger = od()
+    for (elem, ac, _), x in zip(header["accounts"], cols):
+        ledger.setdefault(elem, od())[ac] = Columns(strings, **x)
+    return ledger, strings
+
+
+###
+###     期間ごとの FS のバイナリ形式
+###
+
+SPANMAGIC, SPANVERSION = b"BKSP", 1
+
+def spancolumns(rows):
+    """ iter_span_rows の行 (見出しの行から) を列ごとの array とし、
+    {列名 : array} を返す
+    start, end は日付の序数 (int64)、epi は float64、他の列は int64 """
+    rows = iter(rows)
+    names = next(rows)
+    codes = ["q", "q", "q", "d"] + ["q"] * (len(names) - 4)
+    cols = [array(x) for x in codes]
+    for x in rows:
+        cols[0].append(x[0].toordinal())
+        cols[1].append(x[1].toordinal())
+        for col, v in zip(cols[2:], x[2:]):
+            col.append(v)
+    return od(zip(names, cols))
+
+def spanformat(path, format=None):
+    """ dumpspans, loadspans の形式 ("binary" もしくは "npz") を返す
+    format=None の場合は拡張子 (.npz ならば npz) で判定する """
+    if format is None:
+        return "npz" if path.endswith(".npz") else "binary"
+    elif format not in ("binary", "npz"):
+        raise ValueError("Unknown span format " + repr(format))
+    return format
+
+def dumpspans(rows, path, format=None):
+    """ iter_span_rows の行 (見出しの行から) を列指向で path に保存する
+    format は "binary" もしくは "npz" (numpy の .npy を格納した zip) で、
+    None の場合は拡張子 (.npz ならば npz) で判定する (spanformat)
+    binary はヘッダ (json) に列名と型、行数を格納し、その後に各列を
+    (8 バイト境界から) 連結して格納する
+    いずれも path をそのまま用いる (npz でも拡張子を加えない) """
+    format = spanformat(path, format)
+    cols = spancolumns(rows)
+    if format == "npz":
+        if np is None:
+            raise ImportError("numpy is required to save " + path)
+
+        # numpy.savez は列名を引数名として受け取るため (file などの列名を
+        # 扱えず、拡張子を加える)、.npy を直接 zip に格納する
+        tmp = path + ".tmp"
+        with zipfile.ZipFile(tmp, "w", allowZip64=True) as zf:
+            for x, v in cols.items():
+                with zf.open(x + ".npy", "w", force_zip64=True) as wf:
+                    np.lib.format.write_array(wf, np.frombuffer(v, v.typecode))
+        os.replace(tmp, path)
+        return
+
+    _dumpcols(path, SPANMAGIC, SPANVERSION, {
+        "rows" : len(next(iter(cols.values()))),
+        "columns" : [[x, v.typecode] for x, v in cols.items()]
+    }, cols.values())
+
+def loadspans(path, use_mmap=True, format=None):
+    """ dumpspans で保存したファイルを読み込み、{列名 : 列} を返す
+    format は dumpspans と同じ (None の場合は拡張子で判定する)
+    binary の場合、use_mmap=True ならば各列は mmap 上の memoryview となる
+    (複製しない。numpy.asarray で複製せずに ndarray とできる)
+    npz の場合は numpy の ndarray とする
+    start, end は datetime.date.fromordinal で日付に戻せる """
+
+    if spanformat(path, format) == "npz":
+        if np is None:
+            raise ImportError("numpy is required to load " + path)
+        with np.load(path) as data:
+            return od((x, data[x]) for x in data.files)
+
+    header, take = _loadcols(path, SPANMAGIC, SPANVERSION, "span file", use_mmap)
+    return od(
+        (name, take(code, header["rows"])) for name, code in header["columns"]
+    )
+
+
+###
+###     残高インデックス
+###
+
+class _Index:
+    """ 勘定ごとの残高インデックス
+    通常の行は日付ごとの累積和、schedule 行は終了日順の累積和を保持し、
+    任意の日付までの合計を bisect で求める """
+
+    def __init__(self, rows):
+        self.size = len(rows)
+
+        # 通常の行 (日付の昇順リストと累積和、先頭は 0)
+        if isinstance(rows, Columns):
+            daily, scheds = rows.split()
+        else:
+            daily, scheds = {}, []
+            for x in rows:
+                if len(x) > 4:
+                    scheds.append(x)
+                else:
+                    daily[x[0]] = daily.get(x[0], 0) + x[2]
+        self.dates, self.cums = sorted(daily.keys()), [0]
+        for dt in self.dates:
+            self.cums.append(self.cums[-1] + daily[dt])
+
+        # schedule 行 (終了日の昇順リストと累積和、最長の期間)
+        self.scheds = sorted(scheds, key=lambda x: x[4])
+        self.ends, self.scums = [x[4] for x in self.scheds], [0]
+        for x in self.scheds:
+            self.scums.append(self.scums[-1] + schedsum(x))
+        self.span = max(
+            (x[4] - x[0] for x in self.scheds),
+            default=datetime.timedelta(0)
+        )
+
+    def upto(self, end):
+        """ end までの合計 """
+        rslt = self.cums[bisect.bisect_right(self.dates, end)]
+
+        # end までに終了した schedule 行は累積和、
+        # end をまたぐ schedule 行は schedsum で計算する
+        i = bisect.bisect_right(self.ends, end)
+        rslt += self.scums[i]
+        limit = end + self.span
+        while i < len(self.ends) and self.ends[i] <= limit:
+            if self.scheds[i][0] <= end:
+                rslt += schedsum(self.scheds[i], end=end)
+            i += 1
+        return rslt
+
+    def between(self, start, end):
+        """ start -- end の合計 """
+        return self.upto(end) - self.upto(start - datetime.timedelta(days=1))
+
+    def touches(self, dates):
+        """ dates (集合) のいずれかの日付 (schedule 行は開始日) の行を
+        含むかどうか """
+        for dt in dates:
+            i = bisect.bisect_left(self.dates, dt)
+            if i < len(self.dates) and self.dates[i] == dt:
+                return True
+        return any(x[0] in dates for x in self.scheds)
+
+    def sweep(self, points):
+        """ 昇順の日付のリスト points について、各日付までの合計を
+        日付順の 1 回の走査で求めてリストで返す """
+        rslt, i, j = [], 0, 0
+        for t in points:
+            while i < len(self.dates) and self.dates[i] <= t:
+                i += 1
+            while j < len(self.ends) and self.ends[j] <= t:
+                j += 1
+            total = self.cums[i] + self.scums[j]
+
+            # t をまたぐ schedule 行
+            k, limit = j, t + self.span
+            while k < len(self.ends) and self.ends[k] <= limit:
+                if self.scheds[k][0] <= t:
+                    total += schedsum(self.scheds[k], end=t)
+                k += 1
+            rslt.append(total)
+        return rslt
+
+
+###
+###     bk/adj ファイルから読み込む仕訳帳
+###
+
+class FileJournal(MutableMapping):
+    """ {date : 仕訳のリスト} と同様に扱える journal
+    files ({date : [(path, adj), ...]}) の各日付のファイルは、その日付を
+    参照した時に読み込み (adj ファイルは Schedule とする)、以降は
+    data に保持する (checkpoint から復元した journal に用いる) """
+
+    def __init__(self, bk, files, encoding="utf-8", data=None):
+        self.bk, self.files, self.encoding = bk, files, encoding
+        self.data = dict(data or {})
+
+    def __getitem__(self, date):
+        files = self.files.pop(date, None)
+        if files:
+            entries = self.data.setdefault(date, [])
+            for path, adj in files:
+                x = readjnl(path, self.bk._nestdict, self.encoding)
+                if adj:
+                    x = [self.bk._schedule(date, y) for y in x]
+                entries.extend(x)
+        return self.data[date]
+
+    def __setitem__(self, date, entries):
+        self.files.pop(date, None)
+        self.data[date] = entries
+
+    def __delitem__(self, date):
+        if date not in self:
+            raise KeyError(date)
+        self.files.pop(date, None)
+        self.data.pop(date, None)
+
+    def __contains__(self, date):
+        return date in self.data or date in self.files
+
+    def __iter__(self):
+        return iter(sorted(set(self.data) | set(self.files)))
+
+    def __len__(self):
+        return len(set(self.data) | set(self.files))
+
+    def loaded(self):
+        """ 読み込み済みの日付の仕訳 {date : 仕訳のリスト} """
+        return self.data
+
+
+###
+###     計測
+###
+
+def stage(func):
+    """ Bkeep の公開メソッドを計測の対象とするデコレータ
+    呼び出しの前後に self.hooks の各フックの enter, exit を呼ぶ
+    (self.hooks が空の場合は func をそのまま呼ぶ) """
+    name = func.__name__
+
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if not self.hooks:
+            return func(self, *args, **kwargs)
+        for x in self.hooks:
+            x.enter(self, name)
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            for x in reversed(self.hooks):
+                x.exit(self, name)
+
+    return wrapper
+
+class Profiler:
+    """ Bkeep の公開メソッドごとの所要時間、行数、メモリのピークを
+    記録するフック
+    with Profiler(bk) as prof: ... もしくは start, stop で利用する
+    メソッドの内部で呼ばれたメソッドも、呼び出し元の下の段階として
+    記録する (seconds は内部の段階を含む時間、self は含まない時間)
+    trace=True の場合、tracemalloc によるピーク (KB) も記録する
+    (tracemalloc の分だけ所要時間は長くなる) """
+
+    # メソッドごとの行数 (journal の仕訳数、ledger の行数、fs の期間数)
+    ROWS = {
+        "journalize" : "journal", "write_journal" : "journal",
+        "calcSpan" : "fs", "calcSpans" : "fs", "saveSpan" : "fs",
+        "make" : "fs", "cat" : "fs", "report" : "fs"
+    }
+
+    def __init__(self, bk, trace=True):
+        self.bk, self.trace = bk, trace
+        self.stages = []
+        self._stack = []
+        self._tracing = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """ bk.hooks に登録し、計測を開始する """
+        if self.trace and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        self.bk.hooks.append(self)
+        return self
+
+    def stop(self):
+        """ bk.hooks から削除し、計測を終了する """
+        self.bk.hooks.remove(self)
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def enter(self, bk, name):
+        # 記録は呼び出し順 (呼び出し元の後に内部の段階) に並べる
+        parent = self._stack[-1] if self._stack else None
+        x = {
+            "stage" : name, "depth" : len(self._stack),
+            "path" : parent["record"]["path"] + "/" + name if parent else name
+        }
+        self.stages.append(x)
+
+        # ピークは段階ごとに測り直し、呼び出し元にはそれまでのピークを
+        # 記録しておく (reset_peak は Python 3.9 以降のため、それより前は
+        # clear_traces で代用し、ピークはその段階で新たに確保した分となる)
+        if tracemalloc.is_tracing():
+            if parent:
+                parent["peak"] = max(
+                    parent["peak"], tracemalloc.get_traced_memory()[1]
+                )
+            getattr(tracemalloc, "reset_peak", tracemalloc.clear_traces)()
+        self._stack.append({
+            "record" : x, "start" : time.perf_counter(), "inner" : 0, "peak" : 0
+        })
+
+    def exit(self, bk, name):
+        frame = self._stack.pop()
+        x, seconds = frame["record"], time.perf_counter() - frame["start"]
+        x["seconds"], x["self"] = seconds, seconds - frame["inner"]
+        x["rows"] = self.rows(bk, self.ROWS.get(name, "ledger"))
+        parent = self._stack[-1] if self._stack else None
+        if parent:
+            parent["inner"] += seconds
+        if tracemalloc.is_tracing():
+            peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            x["peak_kb"] = peak // 1024
+            if parent:
+                parent["peak"] = max(parent["peak"], peak)
+            getattr(tracemalloc, "reset_peak", tracemalloc.clear_traces)()
+
+    def rows(self, bk, kind):
+        """ bk の journal の仕訳数、ledger の行数、もしくは fs の期間数 """
+        if kind == "journal":
+            # FileJournal は読み込み済みの日付のみ数える
+            journal = bk.journal
+            if isinstance(journal, FileJournal):
+                journal = journal.loaded()
+            return sum(len(x) for x in journal.values())
+        elif kind == "fs":
+            return len(bk.fs)
+        return sum(len(x) for elem in bk.ledger.values() for x in elem.values())
+
+    def summary(self):
+        """ 呼び出しの経路 (呼び出し元のメソッドと "/" でつないだ名前) ごとに
+        集計した {経路 : {"depth", "calls", "seconds", "self", "rows",
+        ("peak_kb")}} を返す
+        (rows は最後の呼び出し時、peak_kb は最大値) """
+        rslt = od()
+        for x in self.stages:
+            if "seconds" not in x:      # 計測中の段階
+                continue
+            y = rslt.setdefault(x["path"], {
+                "depth" : x["depth"], "calls" : 0, "seconds" : 0, "self" : 0
+            })
+            y["calls"] += 1
+            y["seconds"] += x["seconds"]
+            y["self"] += x["self"]
+            y["rows"] = x["rows"]
+            if "peak_kb" in x:
+                y["peak_kb"] = max(y.get("peak_kb", 0), x["peak_kb"])
+        return rslt
+
+    def cat(self, path=None, encoding="utf-8"):
+        """ メソッドごとの内訳を表示する (path を指定した場合はそこに出力)
+        内部の段階は呼び出し元の下に字下げし、割合は内部の段階を
+        含まない時間 (self) の全体に対する割合とする """
+        summary = self.summary()
+        total = sum(x["seconds"] for x in summary.values() if not x["depth"])
+        name = lambda k, x: "  " * x["depth"] + k.rsplit("/", 1)[-1]
+        n = max([5] + [len(name(k, x)) for k, x in summary.items()]) + 1
+        lines = ["PROFILE", "============="]
+        for k, x in summary.items():
+            lines.append("{:<{}}{:>6,d}{:>10.3f}s{:>10.3f}s{:>8.1%}{:>12,d}{}".format(
+                name(k, x), n, x["calls"], x["seconds"], x["self"],
+                x["self"] / total if total else 0, x["rows"],
+                " {:>10,d}KB".format(x["peak_kb"]) if "peak_kb" in x else ""
+            ))
+        lines.extend(["-------------", "{:<{}}{:>10.3f}s".format("TOTAL", n + 6, total)])
+        if path:
+            with open(path, "w", encoding=encoding) as wf:
+                wf.write("\n".join(lines) + "\n")
+        else:
+            print("\n".join(lines))
+
+    def dump(self, path):
+        """ 各呼び出しの記録とメソッドごとの集計を json で保存する """
+        with open(path, "w") as wf:
+            json.dump(
+                {"stages" : self.stages, "summary" : self.summary()},
+                wf, indent=4
+            )
+
 
 ###
 ###     クラスの定義
 ###
 
+# initial ファイルの内容ごとの勘定科目の階層
+# (_nestdict, _elemdict, _classes, _tree の組で、Bkeep の間で共有する)
+HIERARCHIES = {}
+
 class Bkeep:
     """ 総勘定元帳のデータを格納するクラス。read メソッドによって、仕訳帳
     データを変換し、データをアップデートする """
 
-    def __init__(self, path, date, encoding="utf-8", order=True):
+    def __init__(self, path, date, encoding="utf-8", order=True,
+                 columnar=False, engine="python", store=None, cachesize=4096):
         """ スタートファイル (json 形式の残高試算表) を読み込み、
         self.initial に格納する
-        date はスタート時点の日付であり、datetime.date 型とする """
+        date はスタート時点の日付であり、datetime.date 型とする
+        columnar=True の場合、元帳の各勘定を Columns (型付き配列) で保持する
+        engine="numpy" の場合、calcSpans を numpy で計算する
+        (numpy がインストールされていない場合は "python" となる)
+        store (sqlite3 のファイル) を指定した場合、journal と ledger を
+        そのファイルに保存し、試算表の計算も sqlite3 でおこなう
+        (ファイルの既存のデータは削除する)
+        cachesize は試算表・財務諸表のキャッシュに保持する期間の数
+        (0 ならばキャッシュしない) """
 
         # initial ファイルのパス、文字コード
         self._inittype = path, encoding
 
-        # ordered の属性
+        # ordered, columnar の属性
         self._ordered = order
+        self._columnar = columnar
+        self.engine = engine if np is not None else "python"
+        self._store = Store(store, Schedule) if store else None
+
+        # 計測用のフック (Profiler など、stage のメソッドの前後に呼ばれる)
+        self.hooks = []
+
+        # 前回の update, refresh 時の bk/adj ファイルの一覧
+        self._files = None
+
+        # 期間ごとの試算表・財務諸表のキャッシュ {(start, end) : (版, tb, fs)}
+        # (版は元帳を変更するたびに増やし、異なる版のものは使わない)
+        self.cachesize = cachesize
+        self._cache = od()
+        self._version = 0
+        self._cachefile = None
         
         # initial ファイルの読み込み
         with open(path, "r", encoding=encoding) as rf:
-            if order:
-                self.initial = json.load(rf, object_pairs_hook=od)
-            else:
-                self.initial = json.load(rf)
-
-        # nested list の作成
-        self._mkNamesDict()
+            text = rf.read()
+        if order:
+            self.initial = json.loads(text, object_pairs_hook=od)
+        else:
+            self.initial = json.loads(text)
+
+        # nested list と勘定科目の階層の作成
+        # (内容が同じ initial ファイルの Bkeep では、作成済みのものを共有する)
+        key = (hashlib.sha1(text.encode("utf-8")).hexdigest(), order)
+        if key not in HIERARCHIES:
+            self._mkNamesDict()
+            self._mkTree()
+            HIERARCHIES[key] = (
+                self._nestdict, self._elemdict, self._classes, self._tree
+            )
+        self._nestdict, self._elemdict, self._classes, self._tree = (
+            HIERARCHIES[key]
+        )
 
         # 財務諸表データの初期化
         self.fs = {}
@@ -102,210 +923,430 @@ class Bkeep:
         # 元帳データの初期化
         self.clear_ledger()
 
-        # 仕訳帳データの作成
-        self.journal = {date : []}
-
-        # init データを仕訳帳に仕訳 (_bal は beginning balance)
-        for x in self.initial.keys():
-
-            # 借方科目の場合
-            if x in {"assets", "expenses"}:
-                for y in self.initial[x].keys():
-                    if self.initial[x][y] != 0:
-                        self.journal[date].append((
-                            y, self.initial[x][y],
-                            "_bal", self.initial[x][y], ""
-                        ))
-
-            # 貸方科目の場合
-            else:
-                for y in self.initial[x].keys():
-                    if self.initial[x][y] != 0:
-                        self.journal[date].append((
-                            "_bal", self.initial[x][y],
-                            y, self.initial[x][y], ""
-                        ))
+        # 仕訳帳データの作成 (_start は期首日)
+        self._start = date
+        self.clear_journal()
+        self.journal[date] = self._opening()
 
 
     # 仕訳・転記・締切
 
-    def journalize(self, comb, adj=False, encoding="utf-8"):
+    @stage
+    def journalize(self, comb, adj=False, encoding="utf-8", workers=None):
         """ 仕訳
         {date : path, ...} からなる dict を受けとり、
         各組み合わせごとに self.journal に格納する
         adj=True の場合、仕訳を date から月末までの日数に
-        分割する"""
+        分割する
+        workers (2 以上) を指定した場合、ファイルの読み込みを
+        workers 個のプロセスで並列におこない、comb の順に格納する"""
+
+        # csv データの読み込み
+        # (借方勘定、借方金額、貸方勘定、貸方金額、コメントの形式に変換)
+        paths = list(comb.values())
+        read = partial(readjnl, names=self._nestdict, encoding=encoding)
+        if workers and workers > 1 and len(paths) > 1:
+            chunk = max(1, len(paths) // (workers * 4))
+            with ProcessPoolExecutor(workers) as ex:
+                datas = list(ex.map(read, paths, chunksize=chunk))
+        else:
+            datas = map(read, paths)
 
-        for filedate, path in comb.items():
-            
-            # csv データの読み込み
-            with open(path, "r", encoding=encoding, newline="") as rf:
-                # 借方勘定、借方金額、貸方勘定、貸方金額、コメント
-                # の形式に変換
-                data = list(self._alignjnl(csv.reader(rf)))
+        for (filedate, path), data in zip(comb.items(), datas):
 
             # journal に既に同日のデータが格納されているなら
             # extend、そうでなければ追加
             if adj:
-                for x in data:
-                    self._adjentry(filedate, x)
+                data = [self._adjentry(filedate, x) for x in data]
             else:
                 self._inputtodict(filedate, data)
 
-            # エラー判定
-            if (sum(x[1] for x in self.journal[filedate]) !=
-                sum(x[3] for x in self.journal[filedate])):
-
+            # エラー判定 (同日の既存のデータは貸借が一致しているため、
+            # 追加したデータのみを判定する)
+            if sum(x[1] for x in data) != sum(x[3] for x in data):
                 raise ValueError("Unbalanced in " + path)
 
-    def post(self):
+        # store の変更の確定 (ファイルごとではなく、最後に 1 度だけおこなう)
+        if self._store:
+            self._store.commit()
+
+    @stage
+    def check(self, inpdict, adjdict, encoding="utf-8"):
+        """ bk/adj ファイルの検証 (journal, ledger は変更しない)
+        各ファイルを 1 行ずつ 1 度だけ読み、行の形式、金額、勘定科目名
+        (省略形) と、ファイルごと・日付ごとの貸借の一致を確かめる
+        (ファイルごとは記帳された金額、日付ごとは adj ファイルの日割額と
+        最終日の金額を用いる)
+        見つかった問題をすべて (path, 行番号, 内容) のリストで返す
+        (ファイルの問題を path, 行番号の順に並べ、その後に日付の問題を
+        日付順に並べる)
+        行番号が 0 のものはファイル全体、path が日付 (YYYYMMDD もしくは
+        YYYYMMDD-YYYYMMDD) のものはその日付の合計の問題とする """
+
+        problems, daily = [], {}
+        one = datetime.timedelta(days=1)
+        for adj, comb in ((False, inpdict), (True, adjdict)):
+            for filedate, path in comb.items():
+
+                # ファイルの借方・貸方の合計 (raw) と、日付ごとの差額に
+                # 用いる合計 (adj は日割額と最終日の金額)
+                raw, total = [0, 0], [0, 0, 0, 0]
+                try:
+                    with open(path, "r", encoding=encoding, newline="") as rf:
+                        for i, row in enumerate(csv.reader(rf), 1):
+                            x = self._checkrow(row)
+                            if isinstance(x, str):
+                                problems.append((path, i, x))
+                                continue
+                            raw[0] += x[1]
+                            raw[1] += x[3]
+                            if adj:
+                                x = self._schedule(filedate, x)
+                                total[2] += x.Dlast
+                                total[3] += x.Clast
+                            total[0] += x[1]
+                            total[1] += x[3]
+                except (OSError, UnicodeError) as e:
+                    problems.append((path, 0, str(e)))
+                    continue
+
+                # ファイルごとの貸借の一致
+                if raw[0] != raw[1]:
+                    problems.append((path, 0, "Unbalanced (Dr %d, Cr %d)" % (
+                        raw[0], raw[1]
+                    )))
+
+                # 日付ごとの貸借の差額
+                if not adj:
+                    daily[filedate] = daily.get(filedate, 0) + total[0] - total[1]
+                    continue
+                dt, end = filedate, maxday(filedate)
+                while dt < end:
+                    daily[dt] = daily.get(dt, 0) + total[0] - total[1]
+                    dt += one
+                daily[end] = daily.get(end, 0) + total[2] - total[3]
+
+        # ファイルの問題は path, 行番号の順とする (ファイルの一覧の順に
+        # よらず、同じ入力には同じ順で報告する)
+        problems.sort(key=itemgetter(0, 1))
+
+        # 貸借の一致しない日付 (差額の同じ連続した日付はまとめる)
+        bad = sorted(dt for dt, v in daily.items() if v)
+        while bad:
+            first = last = bad.pop(0)
+            while bad and bad[0] == last + one and daily[bad[0]] == daily[first]:
+                last = bad.pop(0)
+            name = dtstr(first) if first == last else (
+                dtstr(first) + "-" + dtstr(last)
+            )
+            problems.append((name, 0, "Unbalanced by %d" % daily[first]))
+
+        return problems
+
+    @stage
+    def post(self, dates=None):
         """ 転記
         self.journal に保存されている通常の仕訳データを
-        self.ledger に格納する"""
-
-        for day in sorted(self.journal.keys()):
-
-            # 損益勘定の初期化
-            self._incoming = []
-
-            for x in self.journal[day]:
-
-                # 行の貸借金額が一致するならば対照勘定、
-                # そうでなければ sundry (諸口) とする
-                Dcont = x[2] if x[1] == x[3] else "sundry"
-                Ccont = x[0] if x[1] == x[3] else "sundry"
-
-                # 借方項目の転記 (借方勘定、貸方勘定、借方金額、コメント)
-                self._apply(day, x[0], Dcont, x[1], x[-1])
-
-                # 貸方項目の転記 (貸方勘定、借方勘定、貸方金額、コメント)
-                self._apply(day, x[2], Ccont, -x[3], x[-1])
+        self.ledger に格納する
+        日割計算の仕訳 (Schedule) は、[開始日, 対照勘定, 日割額, コメント,
+        終了日, 最終日の金額] の schedule 行として転記する
+        dates を指定した場合、その日付の仕訳データのみを転記する
+        (残高インデックスは、行の増えた勘定のみ参照時に作り直す)"""
+
+        self._version += 1
+        days = self.journal.keys() if dates is None else dates
+        targets = self._targets()
+        for day in sorted(days):
+            self._postday(day, self.journal[day], targets)
+        if self._store:
+            self._store.commit()
+
+        # 残高インデックスの作成
+        if dates is None:
+            self.mkindex()
+
+    @stage
+    def unpost(self, dates):
+        """ 転記の取り消し
+        dates に含まれる日付 (schedule 行は開始日) の行を
+        self.ledger から削除する """
+        self._version += 1
+        dates = set(dates)
+        if self._store:
+            self._store.unpost(dates)
+            self._store.commit()
+            return
+        for elem in self.ledger.keys():
+            for ac in self.ledger[elem].keys():
 
-            # 損益勘定の剰余金への振り替え
-            if self._incoming:
-                self.ledger["equity"]["retained"].append(
-                    [day, "_incoming",
-                     sum(x[2] for x in self._incoming), ""]
+                # インデックスから dates の行がないとわかる勘定は飛ばす
+                rows = self.ledger[elem][ac]
+                idx = self._index.get((elem, ac))
+                if idx and idx.size == len(rows) and not idx.touches(dates):
+                    continue
+
+                # Columns は列のまま削除する (checkpoint の snapshot など)
+                if isinstance(rows, Columns):
+                    if rows.drop(dates):
+                        self._index.pop((elem, ac), None)
+                    continue
+                self.ledger[elem][ac] = self._rows(
+                    x for x in rows if x[0] not in dates
                 )
-
-    def close(self):
+                self._index.pop((elem, ac), None)
+
+    @stage
+    def update(self, inpdict, adjdict, path, encoding="utf-8", workers=None):
+        """ checkpoint ファイル (path) を利用した仕訳・転記
+        前回から追加・変更・削除された bk/adj ファイルが影響する
+        日付のみを再度仕訳・転記し、checkpoint を更新する
+        初期化ファイルや期首日が変わった場合は、全体を作り直す
+        checkpoint は元データの一覧 (path) と元帳の snapshot (.bkl) からなり、
+        仕訳帳は保存せず、必要な時に bk/adj ファイルから読み込む
+        ファイルは内容 (sha1) で比較し、サイズ・更新時刻はハッシュを
+        計算し直すかの判定にのみ用いる
+        再度仕訳・転記した日付の集合を返す """
+
+        # 前回と今回のファイル一覧
+        old = None
+        if os.path.exists(path) and os.path.exists(self._ckledger(path)):
+            with open(path, "r", encoding="utf-8") as rf:
+                old = json.load(rf)
+        oldinit = old.get("init") if old else None
+        oldfiles = old.get("files", {}) if old else {}
+        manifest = {
+            "version" : 3,
+            "init" : filestat(self._inittype[0], oldinit),
+            "start" : dtstr(self._start),
+            "files" : self._manifest(inpdict, adjdict, oldfiles)
+        }
+
+        # 全体の作り直しの場合
+        if (not old or old.get("version") != manifest["version"] or
+            not samefile(old["init"], manifest["init"]) or
+            old["start"] != manifest["start"]):
+
+            affected = self._rebuild(inpdict, adjdict, encoding, workers)
+        else:
+            self.read_checkpoint(path, encoding)
+            affected = self._refresh(
+                inpdict, adjdict, oldfiles, manifest["files"],
+                encoding, workers
+            )
+
+        # 更新時刻のみ変わった場合は一覧のみ保存する
+        # (次回、そのファイルのハッシュの計算を省く)
+        self._files = manifest["files"]
+        if affected or manifest != old:
+            self.write_checkpoint(path, manifest, ledger=bool(affected))
+        return affected
+
+    @stage
+    def refresh(self, inpdict, adjdict, encoding="utf-8", workers=None):
+        """ 前回の update, refresh 時のファイル一覧と比較し、
+        追加・変更・削除された bk/adj ファイルが影響する日付のみを
+        再度仕訳・転記する (checkpoint ファイルは読み書きしない)
+        常駐して繰り返し呼ぶ場合に用い、初回は全体を作り直す
+        再度仕訳・転記した日付の集合を返す """
+        files = self._manifest(inpdict, adjdict, self._files or {})
+        if self._files is None:
+            affected = self._rebuild(inpdict, adjdict, encoding, workers)
+        else:
+            affected = self._refresh(
+                inpdict, adjdict, self._files, files, encoding, workers
+            )
+        self._files = files
+        return affected
+
+    @stage
+    def close(self, date, path=None):
         """ 締め切り
-        試算表上の収益・費用の各項目を _closing を対照勘定
-        として仕訳し、転記する (次年度の start ファイルを作成
-        する際に活用できる) """
-        pass
+        date 時点の試算表上の収益・費用の各項目を _closing を対照勘定
+        として仕訳する (次年度の start ファイルを作成する際に活用できる)
+        締切仕訳は snapshot 用の元帳の複製にのみ転記し、self.journal,
+        self.ledger は変更しない (以降の期間の収益・費用を変えないため)
+        収益・費用は日々 retained に振り替えているため、_closing の行は
+        retained には計上しない
+        次期の初期化ファイル (init.json と同じ形式) の dict を返す
+        path (ディレクトリ) を指定した場合、次期の初期化ファイル
+        initYYYYMMDD.json と、date までの元帳に締切仕訳を転記した snapshot
+        ledgerYYYYMMDD.bkl を path に保存する """
+
+        # 締切仕訳の作成
+        tb = self.balances(date)
+        entries = []
+        for ac, v in tb["income"].items():
+            if v:
+                entries.append((ac, v, "_closing", v, ""))
+        for ac, v in tb["expenses"].items():
+            if v:
+                entries.append(("_closing", v, ac, v, ""))
+
+        # 次期の初期化データ (収益・費用は 0 とする)
+        cldict = od if self._ordered else dict
+        init = cldict()
+        for elem in self.initial.keys():
+            init[elem] = cldict(
+                (ac, 0 if elem in ("income", "expenses") else v)
+                for ac, v in tb[elem].items()
+            )
+
+        if path:
+            with open(os.path.join(path, "init%s.json" % dtstr(date)),
+                      "w", encoding=self._inittype[1]) as wf:
+                json.dump(init, wf, indent=4, ensure_ascii=False)
+
+            # date までの元帳の複製 (schedule 行は date で打ち切る) に
+            # 締切仕訳を転記する
+            ledger = {
+                elem : {
+                    ac : cutrows(self.ledger[elem][ac], date)
+                    for ac in self.ledger[elem].keys()
+                }
+                for elem in self.ledger.keys()
+            }
+            targets = {
+                ac : (ledger[elem][ac], sign, pl)
+                for ac, (elem, sign, pl) in self._classes.items()
+            }
+            self._postday(date, entries, targets)
+            dumpledger(ledger, os.path.join(path, "ledger%s.bkl" % dtstr(date)))
+
+        return init
 
 
     # 試算表・財務諸表の作成
 
+    @stage
     def prepare(self, start, end):
         """ 試算表の作成
         self.tb に格納"""
 
-        # tb の初期化
-        self.clear_tb()
-
         # tb の名前を記憶
         self._tbname = (start, end)
 
-        # assets, liabilities, equity
-        for elem in ("assets", "liabilities", "equity"):
-            for ac in self.initial[elem].keys():
-                self.tb[elem][ac] = sum(
-                    x[2] for x in self.ledger[elem][ac]
-                    if x[0] <= end
-                )
-
-        # expenses, income
-        for elem in ("expenses", "income"):
+        # tb の作成 (キャッシュにあれば、それを用いる)
+        tb, _ = self._cached(self._tbname)
+        if tb is None:
+            tb = self.balances(end, start)
+            self._remember(self._tbname, tb=tb)
+        self.tb = tb
+
+    def balance(self, account, at):
+        """ account (正式名称もしくは省略形) の at 時点の残高
+        (income, expenses は at までの累積額) を返す """
+        return self._getindex(*self._account(account)).upto(at)
+
+    def flow(self, account, start, end):
+        """ account (正式名称もしくは省略形) の start -- end の増減額を返す """
+        return self._getindex(*self._account(account)).between(start, end)
+
+    def balances(self, at, start=None):
+        """ at 時点の試算表 (self.tb と同じ形式) を返す
+        assets, liabilities, equity は at 時点の残高、
+        expenses, income は start -- at の発生額 (start=None ならば累積額)
+        とする。self.tb は変更しない """
+        cldict = od if self._ordered else dict
+        tb = cldict()
+        for elem in self.initial.keys():
+            tb[elem] = cldict()
+            flow = start is not None and elem in ("expenses", "income")
             for ac in self.initial[elem].keys():
-                self.tb[elem][ac] = sum(
-                    x[2] for x in self.ledger[elem][ac]
-                    if x[0] >= start and x[0] <= end
-                )
+                idx = self._getindex(elem, ac)
+                tb[elem][ac] = idx.between(start, at) if flow else idx.upto(at)
+        return tb
 
+    @stage
     def make(self, add=False):
         """ 貸借対照表・損益計算書の作成 
         add=True ならば、データを追加する
-        期間は self._tbname を参照する"""
+        期間は self._tbname を参照する
+        (prepare がキャッシュから返した tb ならば、fs もキャッシュから返す)"""
 
         # add=False なら self.fs を初期化
         if not add:
             self.fs = {}
 
-        # fs 項目の初期化
-        self.fs[self._tbname] = self.clear_fs()
-        fs = self.fs[self._tbname]
-
-        # fs 項目の格納
-        for elem in fs.keys():
-
-            # tb 項目のプールの作成
-            pool = [x.split(":") for x in self._acquire_keys(self.tb)]
+        # キャッシュにある場合
+        tb, fs = self._cached(self._tbname)
+        if fs is not None and tb is self.tb:
+            self.fs[self._tbname] = fs
+            return
 
-            # fs の各項目の計算対象の抽出
-            for x in fs[elem].keys():
-                s = x.replace(":", "")
-                trg = (":".join(y) for y in pool if s in y) 
+        # fs 項目の初期化
+        cldict = od if self._ordered else dict
+        self.fs[self._tbname] = fs = cldict()
 
-                # 計算対象の合計と格納
-                fs[elem][x] = sum(self.tb[elem][y] for y in trg)
+        # fs 項目の格納 (tb の各勘定の金額を、その勘定が属する
+        # fs 項目に加算する)
+        for elem, (names, parents) in self._tree.items():
+            values = [0] * len(names)
+            for ac, amount in self.tb[elem].items():
+                for i in parents[ac]:
+                    values[i] += amount
+            fs[elem] = cldict(zip(names, values))
 
             # 項目の合計値の格納
             fs[elem][elem.upper()] = sum(self.tb[elem].values())
+
+        self._remember(self._tbname, self.tb, fs)
                 
 
+    @stage
     def cat(self, path=None, encoding="utf-8"):
         """ 貸借対照表・損益計算書の作成
-        self.fs を参照する """
+        self.fs を参照する (path を指定した場合はそこに出力する) """
 
         fs = self.fs[self._tbname]
-        total = {x : fs[x][x.upper()] for x in fs.keys()}
-        earn = total["income"] - total["expenses"]
-        epi = earn / total["income"] if total["income"] else 0
-
-        # 費用項目のデフレート
-        # income に唯一の salary が存在するならば、salary をデフレーターにし、
-        # そうでない場合は、収益総額をデフレーターにする
-        namebox = [s for s in fs['income'].keys() if 'salary' in s]
-        exdeflator = fs['income'][namebox[0]] if len(namebox) == 1 else total['income']
-
-        # 勘定科目名の最大値
-        n = max(len(x.replace(":", "  ")) for x in self._acquire_keys(fs))
-        m = max(len("{:,d}".format(x)) for x in self._acquire_values(fs)) 
-        mp = max(len("{:.2%}".format(x)) for x in self._acquire_values(fs)) 
-        m = max([5, m])
-
-        # path が指定されている場合はそこに出力する
+        text = "\n".join(self._render(fs, self._layout([fs]))) + "\n"
         if path:
-            sys.stdout = open(path, "w", encoding=encoding)
-
-        # 結果の print (assets ~ expenses)
-        for elem in fs.keys():
-            print(elem.upper())
-            print("=============")
-            if elem == 'expenses':
-                for x in list(fs[elem].items())[:-1]:
-                    print("{:<{}}{:>{},d}{:>{}.2%}".format(x[0].replace(":", "  "), n+1, x[1], m, (x[1] / exdeflator), mp))
-                print("-------------")
-                print("{:<{}}{:>{},d}{:>{}.2%}\n".format("TOTAL", n+1, total[elem], m, (total[elem] / exdeflator), mp))
-            else:
-                for x in list(fs[elem].items())[:-1]:
-                    print("{:<{}}{:>{},d}".format(x[0].replace(":", "  "), n+1, x[1], m))
-                print("-------------")
-                print("{:<{}}{:>{},d}\n".format("TOTAL", n+1, total[elem], m))
-
-        # 結果の print (summary)
-        print("SUMMARY")
-        print("=============")
-        print("{:<{}}{:>{},d}".format("earn", n+1, earn, m))
-        print("{:<{}}{:>{}.2%}".format("epi", n+1, epi, m))
-
-        # print の出力先を元に戻す
-        if path:
-            sys.stdout.close()
-            sys.stdout = sys.__stdout__
+            with open(path, "w", encoding=encoding) as wf:
+                wf.write(text)
+        else:
+            sys.stdout.write(text)
+
+    @stage
+    def report(self, path, fs=None, encoding="utf-8", split=False,
+               workers=None):
+        """ 複数期間からなる FS (fs=None ならば self.fs) の各期間の
+        貸借対照表・損益計算書を、cat と同じ形式で出力する
+        split=False ならば、期間の順 (iter_span_rows と同じ) に見出しを付けて
+        path (.gz ならば圧縮する) にまとめ、split=True ならば、path
+        (ディレクトリ) に期間ごとの catYYYYMMDD-YYYYMMDD.txt として出力する
+        列の幅は全期間についてまとめて計算する
+        workers を指定した場合、その数のスレッドで作成・出力する
+        出力したファイルのリストを返す """
+
+        fs = self.fs if fs is None else fs
+        span = sorted(fs.keys(), key=lambda x: (x[1], x[0]))
+        layout = self._layout([fs[x] for x in span])
+
+        # 期間ごとの出力
+        def render(prd):
+            lines = self._render(fs[prd], layout)
+            if not split:
+                head = "%s ~ %s" % (
+                    prd[0].strftime("%Y-%m-%d"), prd[1].strftime("%Y-%m-%d")
+                )
+                return "\n".join([head, "=============", ""] + lines) + "\n"
+            name = os.path.join(
+                path, "cat%s-%s.txt" % (dtstr(prd[0]), dtstr(prd[1]))
+            )
+            with open(name, "w", encoding=encoding) as wf:
+                wf.write("\n".join(lines) + "\n")
+            return name
+
+        if workers:
+            with ThreadPoolExecutor(workers) as ex:
+                rslt = list(ex.map(render, span))
+        else:
+            rslt = [render(x) for x in span]
+        if split:
+            return rslt
 
+        with openw(path, encoding) as wf:
+            wf.write("\n".join(rslt))
+        return [path]
 
     # 月次・週次データの作成
 
@@ -318,6 +1359,15 @@ class Bkeep:
             yield (start, mid)
             start = mid + datetime.timedelta(days=1)
 
+    def mkYear(self, start, end):
+        """ 年次 csv 用の start -- end の組み合わせ作成 """
+
+        while start <= end:
+            mid = datetime.date(start.year, 12, 31)
+            mid = mid if mid < end else end
+            yield (start, mid)
+            start = mid + datetime.timedelta(days=1)
+
     def mkSpan(self, start, end, span=7):
         """ 任意の期間の start -- end の組み合わせ作成
         起点は end
@@ -329,29 +1379,160 @@ class Bkeep:
             yield (mid, end)
             end = mid - datetime.timedelta(days=1)
 
+    def mkRolling(self, start, end, window, step=1):
+        """ 移動期間 (直近 window 日) の start -- end の組み合わせ作成
+        期間の末日は start + window - 1 から step 日ごと (end まで)
+        window, step は 1 以上とする """
+
+        if window < 1 or step < 1:
+            raise ValueError("window and step must be 1 or more.")
+        return self._rolling(start, end, window, step)
+
+    @stage
+    def rolling(self, window, step=1, start=None, end=None):
+        """ start -- end (None ならば期首日、journal の最終日) の
+        直近 window 日の期間ごとの FS を、step 日ごとに計算する
+        各勘定の累積額を 1 回の走査で求め (calcSpans)、期間の末日と
+        window 日前の累積額の差を期間の発生額とする
+        calcSpan 後の self.fs と同じ形式 (saveSpan で保存できる) を返す """
+
+        start = self._start if start is None else start
+        end = max(self.journal.keys()) if end is None else end
+        span = self.mkRolling(start, end, window, step)
+        return self.calcSpans({"rolling" : span})["rolling"]
+
+    @stage
     def calcSpan(self, span):
         """ span (start -- end のタプルからなる iterable) をもとに
         prepare, make をおこなう """
 
-        self.fs = {}
-        for x in span:
-            self.prepare(*x)
-            self.make(add=True)
+        self.fs = self.calcSpans({"span" : span})["span"]
+
+    @stage
+    def calcSpans(self, spans):
+        """ 複数の粒度の期間 {名前 : span} をまとめて計算する
+        全期間の境界日について、各勘定の累積額を日付順の 1 回の走査で求め、
+        各期間の試算表と財務諸表を作成する
+        キャッシュに財務諸表がある期間は計算しない
+        {名前 : fs} (fs は calcSpan 後の self.fs と同じ形式) を返す """
+
+        spans = {name : list(span) for name, span in spans.items()}
+        hits = {}
+        for span in spans.values():
+            for x in span:
+                if x not in hits:
+                    hits[x] = self._cached(x)[1]
+        hits = {x : fs for x, fs in hits.items() if fs is not None}
+        todo = {
+            name : [x for x in span if x not in hits]
+            for name, span in spans.items()
+        }
+        if not any(todo.values()):
+            rslt = {name : {} for name in todo.keys()}
+        elif self.engine == "numpy" and not self._store:
+            rslt = self._npSpans(todo)
+        else:
+            rslt = self._pySpans(todo)
+
+        # キャッシュの期間と合わせ、span の順とする
+        for name, span in spans.items():
+            fs = rslt[name]
+            self.fs = {x : fs[x] if x in fs else hits[x] for x in span}
+            rslt[name] = self.fs
+        return rslt
 
-    def saveSpan(self, path, encoding="utf-8"):
-        """ 複数期間からなる FS を path に保存する """
+    def _pySpans(self, spans):
+        """ calcSpans の内部関数 (python 版) """
+
+        one = datetime.timedelta(days=1)
+
+        # 境界日 (期間の前日と末日) と各勘定の累積額
+        points = sorted({
+            y for span in spans.values()
+            for start, end in span for y in (start - one, end)
+        })
+        pos = {x : i for i, x in enumerate(points)}
+        cums = {
+            (elem, ac) : self._getindex(elem, ac).sweep(points)
+            for elem in self.initial.keys()
+            for ac in self.initial[elem].keys()
+        }
+
+        rslt = {}
+        for name, span in spans.items():
+            self.fs = {}
+            for start, end in span:
+                self.clear_tb()
+                self._tbname = (start, end)
+                i, j = pos[start - one], pos[end]
+                for elem in self.initial.keys():
+                    flow = elem in ("expenses", "income")
+                    for ac in self.initial[elem].keys():
+                        x = cums[(elem, ac)]
+                        self.tb[elem][ac] = x[j] - x[i] if flow else x[j]
+                self.make(add=True)
+            rslt[name] = self.fs
+        return rslt
 
-        span = sorted(self.fs.keys(), key=lambda x: (x[1], x[0]))
+    @stage
+    def saveSpan(self, path, encoding="utf-8", fs=None, format=None):
+        """ 複数期間からなる FS (fs=None ならば self.fs) を path に保存する
+        (行は iter_span_rows から 1 行ずつ書き出し、.gz ならば圧縮する)
+        format は "csv"、"binary" もしくは "npz" (列指向、dumpspans) で、
+        None の場合は拡張子 (.bks ならば binary、.npz ならば npz) で判定する """
+
+        format = self._spanformat(path, format)
+        if format != "csv":
+            return dumpspans(self.iter_span_rows(fs), path, format)
+        with openw(path, encoding) as wf:
+            csv.writer(wf).writerows(self.iter_span_rows(fs))
+
+    def iter_journal(self):
+        """ journal の仕訳を (日付, 仕訳) として日付順に返す
+        Schedule は日ごとの仕訳に展開し、各日の通常の仕訳の後に
+        開始日の順に並べる (展開は 1 日分ずつおこなう) """
+
+        # 開始日順の Schedule と、Schedule のある日付
+        scheds, days = [], set(self.journal.keys())
+        for day in self.journal.keys():
+            for x in self.journal[day]:
+                if isinstance(x, Schedule):
+                    scheds.append((day, x))
+                    days.update(
+                        day + datetime.timedelta(days=i)
+                        for i in range((x.end - day).days + 1)
+                    )
+        scheds.sort(key=lambda x: x[0])
+
+        # active は日割計算の途中の (終了日, Schedule の日ごとの仕訳)
+        active, i = [], 0
+        for day in sorted(days):
+            for x in self.journal.get(day, []):
+                if not isinstance(x, Schedule):
+                    yield day, x
+            while i < len(scheds) and scheds[i][0] == day:
+                active.append((scheds[i][1].end, scheds[i][1].days(day)))
+                i += 1
+            for end, x in active:
+                yield next(x)
+            active = [x for x in active if x[0] > day]
+
+    def iter_span_rows(self, fs=None):
+        """ 複数期間からなる FS (fs=None ならば self.fs) を、見出しの行、
+        期間ごとの [start, end, earn, epi, 各項目の金額...] の順に返す """
+
+        fs = self.fs if fs is None else fs
+        span = sorted(fs.keys(), key=lambda x: (x[1], x[0]))
         name = ["start", "end", "earn", "epi"]
-        name.extend(self._acquire_keys(self.fs[self._tbname]))
-        rslt = [name]
+        name.extend(self._acquire_keys(fs[span[-1]]))
+        yield name
         for prd in span:
             # start と end
             x = list(prd)
 
             # income と expenses の計算
-            R = self.fs[prd]["income"]["INCOME"]
-            L = self.fs[prd]["expenses"]["EXPENSES"]
+            R = fs[prd]["income"]["INCOME"]
+            L = fs[prd]["expenses"]["EXPENSES"]
 
             # earn の計算
             x.append(R - L)
@@ -360,49 +1541,163 @@ class Bkeep:
             x.append(x[-1] / R if R else 0)
 
             # 他の部分の追加
-            x.extend(self._acquire_values(self.fs[prd]))
-
-            # rslt への append
-            rslt.append(x)
+            x.extend(self._acquire_values(fs[prd]))
 
-        # データの保存
-        with open (path, "w", encoding=encoding) as wf:
-            csv.writer(wf).writerows(rslt)
+            yield x
 
 
 
     # 特殊なデータの読み込み・初期化
 
-    def read_ledger(self, path):
-        """ ledger ファイル (json) を self.ledger に読み込む """
+    @stage
+    def read_ledger(self, path, format=None):
+        """ ledger ファイルを self.ledger に読み込む
+        format は "json"、"binary" (snapshot) もしくは "sqlite" で、None の
+        場合は拡張子 (.bkl ならば binary、.db ならば sqlite) で判定する
+        sqlite の場合は、そのファイルを journal, ledger の保存先とする
+        (write_ledger の ledger.db のように journal が空の場合は、
+        他の形式と同じく self.journal をそのまま用いる) """
+        self._version += 1
+        format = self._ledgerformat(path, format)
+        if format == "sqlite":
+            self._store = Store(path, Schedule)
+            self.ledger = self._store.ledger(self.initial)
+            journal = self._store.journal()
+            if len(journal):
+                self.journal = journal
+        elif format == "binary":
+            ledger, strings = loadledger(path)
+            if self._columnar and not self._store:
+                self.ledger, self._strings = ledger, strings
+            else:
+                self._setledger(ledger)
+        else:
+            with open(path, "r", encoding="utf-8") as rf:
+                self.ledger = json.load(rf) 
+                self._dtparse()
+            self._setledger(self.ledger)
+        self.mkindex()
+
+    @stage
+    def read_checkpoint(self, path, encoding="utf-8"):
+        """ checkpoint (元データの一覧 path と元帳の snapshot) を読み込み、
+        manifest を返す
+        self.ledger は snapshot の Columns (mmap 上の列、変更時に複製) とし、
+        self.journal は一覧の bk/adj ファイルを参照した日付のみ読み込む
+        FileJournal とする """
         with open(path, "r", encoding="utf-8") as rf:
-            self.ledger = json.load(rf) 
-            self._dtparse()
-
+            manifest = json.load(rf)
+        self._version += 1
+        ledger, strings = loadledger(self._ckledger(path))
+        if self._store:
+            self._setledger(ledger)
+        else:
+            self.ledger, self._strings = ledger, strings
+        self._index = {}
+
+        # 仕訳帳 (期首日の仕訳の後に、bk, adj ファイルの順とする)
+        files = {}
+        for kind in ("bk", "adj"):
+            for p, x in manifest["files"].items():
+                if x[0] == kind:
+                    files.setdefault(strdt(x[1]), []).append((p, kind == "adj"))
+        self.journal = FileJournal(
+            self, files, encoding, {self._start : self._opening()}
+        )
+        return manifest
+
+    @stage
+    def write_checkpoint(self, path, manifest, ledger=True):
+        """ manifest (元データの一覧) を path (json) に、ledger を
+        snapshot (path の拡張子を .bkl としたもの) に保存する
+        snapshot の Columns の勘定は、列をそのまま書き出す
+        ledger=False の場合は manifest のみ保存する """
+        if ledger:
+            dumpledger(self.ledger, self._ckledger(path))
+        with open(path, "w", encoding="utf-8") as wf:
+            json.dump(manifest, wf, ensure_ascii=False)
+
+    @stage
+    def read_cache(self, path, ledger):
+        """ write_cache で保存した試算表・財務諸表のキャッシュ (json) を
+        読み込み、読み込んだ期間の数を返す
+        ledger は現在の元帳を保存したファイルで、その内容と初期化ファイルが
+        保存時と異なる場合は読み込まない (元帳の読み込み・転記の後に呼ぶ) """
+        pairs = od if self._ordered else None
+        with open(path, "r", encoding="utf-8") as rf:
+            data = json.load(rf, object_pairs_hook=pairs)
+        key = self._cachekey(ledger)
+        if data.get("key") != key:
+            return 0
+        for start, end, tb, fs in data["periods"]:
+            self._remember((strdt(start), strdt(end)), tb, fs)
+        self._cachefile = (path, key, self._cachekeys())
+        return len(data["periods"])
+
+    @stage
+    def write_cache(self, path, ledger):
+        """ 試算表・財務諸表のキャッシュを json で保存する
+        ledger は現在の元帳を保存したファイル (write_ledger の path) で、
+        その内容のハッシュを read_cache での照合に用いる
+        read_cache で読み込んだ時から期間が増減していなければ保存しない """
+        key = self._cachekey(ledger)
+        if self._cachefile == (path, key, self._cachekeys()):
+            return
+        periods = [
+            [dtstr(x[0]), dtstr(x[1]), tb, fs]
+            for x, (version, tb, fs) in self._cache.items()
+            if version == self._version
+        ]
+        with open(path, "w", encoding="utf-8") as wf:
+            json.dump(
+                {"key" : key, "periods" : periods}, wf, ensure_ascii=False
+            )
+        self._cachefile = (path, key, self._cachekeys())
+
+    @stage
     def write_journal(self, path, encoding="utf-8"):
-        """ journal をファイルに保存 """
-
-        # 書き出し用データの作成
-        rslt = [["date", "Dr", "amount",
-                 "Cr", "amount", "comment"]]
-        for day in sorted(self.journal.keys()):
-            for x in self.journal[day]:
-                rslt.append([dtstr(day)])
-                rslt[-1].extend(x)
-
-        # データの書き出し
+        """ journal をファイルに保存
+        (行は iter_journal から 1 行ずつ書き出し、.gz ならば圧縮する) """
+
+        with openw(path, encoding) as wf:
+            writer = csv.writer(wf)
+            writer.writerow(["date", "Dr", "amount", "Cr", "amount", "comment"])
+            writer.writerows(
+                (dtstr(day), *x) for day, x in self.iter_journal()
+            )
+
+    @stage
+    def write_ledger(self, path, encoding="utf-8", format=None):
+        """ ledger をファイルに保存
+        format は read_ledger と同じ ("binary" は snapshot 形式)
+        json では schedule 行を日ごとの行に展開する (dailyrows) """
+        format = self._ledgerformat(path, format)
+        if format == "binary":
+            return dumpledger(self.ledger, path)
+        elif format == "sqlite":
+            if self._store and self._store.path == path:
+                return self._store.commit()
+            store = Store(path, Schedule)
+            ledger = store.ledger(self.initial, clear=True)
+            for elem in ledger.keys():
+                for ac in ledger[elem].keys():
+                    ledger[elem][ac].extend(self.ledger[elem][ac])
+            return store.commit()
+        # json では schedule 行を日ごとの行に展開する
+        # (日付は json.dump の default で文字列に変換する)
+        ledger = {
+            elem : {
+                ac : dailyrows(self.ledger[elem][ac])
+                for ac in self.ledger[elem].keys()
+            }
+            for elem in self.ledger.keys()
+        }
         with open(path, "w", encoding=encoding) as wf:
-            csv.writer(wf).writerows(rslt)
-        
-
-    def write_ledger(self, path, encoding="utf-8"):
-        """ ledger をファイルに保存 """
-        with open(path, "w", encoding=encoding) as wf:
-            self._dtfmt()
-            json.dump(self.ledger, wf, 
-                      indent=4, ensure_ascii=False)
-            self._dtparse()
+            json.dump(ledger, wf, 
+                      indent=4, ensure_ascii=False,
+                      default=jsondefault)
 
+    @stage
     def write_tb(self, path, encoding="utf-8"):
         """ ledger をファイルに保存 """
         with open(path, "w", encoding=encoding) as wf:
@@ -411,13 +1706,27 @@ class Bkeep:
 
     def clear_journal(self):
         """ journal を初期化 """
-        self.journal = {}
+        if self._store:
+            self.journal = self._store.journal(clear=True)
+        else:
+            self.journal = {}
 
     def clear_ledger(self):
         """ ledger を初期化 """
+        self._version += 1
+        self._index = {}
+        if self._store:
+            self.ledger = self._store.ledger(self.initial, clear=True)
+            return
+        self._strings = Strings()
         self.ledger = {x : {} for x in self.initial.keys()}
         for x in self.ledger.keys():
-            self.ledger[x] = {y : [] for y in self.initial[x].keys()}
+            self.ledger[x] = {y : self._rows() for y in self.initial[x].keys()}
+
+    def clear_cache(self):
+        """ 試算表・財務諸表のキャッシュを初期化
+        (ledger, tb を直接変更した場合に呼ぶ) """
+        self._cache = od()
 
     def clear_tb(self):
         """ tb を初期化"""
@@ -461,9 +1770,19 @@ class Bkeep:
 
     def sort(self):
         """ ledger の各勘定について、datetime.date の順でソートする """
+        self._version += 1
+        for elem in self.ledger.keys():
+            for ac in self.ledger[elem].keys():
+                self._sortrows(self.ledger[elem][ac])
+
+    def mkindex(self):
+        """ ledger の各勘定について、累積和からなるインデックス (_Index)
+        を作成し、self._index に格納する
+        prepare は bisect のみで試算表を作成できる """
+        self._index = {}
         for elem in self.ledger.keys():
             for ac in self.ledger[elem].keys():
-                self.ledger[elem][ac].sort(key=lambda x: x[0])
+                self._getindex(elem, ac)
 
 
     # 内部関数
@@ -471,37 +1790,306 @@ class Bkeep:
     def _mkNamesDict(self):
         keys = self._acquire_keys(self.initial)
         self._nestdict = {x.split(":")[-1] : x for x in keys}
+        self._elemdict = {
+            x : elem for elem in self.initial.keys()
+            for x in self.initial[elem].keys()
+        }
+
+        # 勘定名 : (elem, 符号, retained に振り替えるか)
+        # (assets, expenses は借方、それ以外は貸方を正とする)
+        self._classes = {
+            x : (elem, 1 if elem in ("assets", "expenses") else -1,
+                 elem in ("income", "expenses"))
+            for x, elem in self._elemdict.items()
+        }
+
+    def _account(self, name):
+        """ 勘定科目名 (正式名称もしくは省略形) から (elem, 正式名称) を返す """
+        name = name if name in self._elemdict else self._getanm(name)
+        return self._elemdict[name], name
+
+    def _mkTree(self):
+        """ 勘定科目の階層 (a:b:c) をもとに、要素ごとに
+        (fs 項目名のリスト, {勘定名 : その勘定が属する fs 項目の番号のリスト})
+        を作成し、self._tree に格納する (make で利用する)
+        (food:food のように同じ項目名が重なる場合、番号は 1 度のみとする) """
+        self._tree = od()
+        fs = self.clear_fs()
+        for elem in fs.keys():
+            names = list(fs[elem].keys())
+            pos = {x.replace(":", "") : i for i, x in enumerate(names)}
+            parents = {
+                ac : list(dict.fromkeys(
+                    pos[x] for x in ac.split(":") if x in pos
+                ))
+                for ac in self.initial[elem].keys()
+            }
+            self._tree[elem] = (names, parents)
 
     def _getanm(self, name):
         """ 省略形 (最終項目名のみ) 表示を正式名称に変換する """
         return self._nestdict[name] if name else ""
 
+    def _ledgerformat(self, path, format):
+        """ ledger ファイルの形式 (json もしくは binary) を返す """
+        if format:
+            return format
+        elif path.endswith(".bkl"):
+            return "binary"
+        elif path.endswith(".db"):
+            return "sqlite"
+        return "json"
+
+    def _rolling(self, start, end, window, step):
+        """ mkRolling の内部関数 (期間を順に返す generator) """
+
+        one = datetime.timedelta(days=1)
+        last = start + (window - 1) * one
+        while last <= end:
+            yield (last - (window - 1) * one, last)
+            last += step * one
+
+    def _spanformat(self, path, format):
+        """ saveSpan の形式 (csv, binary もしくは npz) を返す """
+        if format:
+            return format
+        elif path.endswith(".bks"):
+            return "binary"
+        elif path.endswith(".npz"):
+            return "npz"
+        return "csv"
+
+    def _sortrows(self, rows):
+        """ 元帳の勘定 rows を日付の順に並べ替える """
+        if isinstance(rows, Columns):
+            rows.sortdate()
+        else:
+            rows.sort(key=itemgetter(0))
+
+    def _ckledger(self, path):
+        """ checkpoint (path) の元帳の snapshot のパス """
+        return os.path.splitext(path)[0] + ".bkl"
+
+    def _rows(self, rows=()):
+        """ 元帳の勘定 (columnar ならば Columns、そうでなければ list) を作る """
+        if self._columnar:
+            return Columns(self._strings, rows)
+        return list(rows)
+
+    def _setledger(self, ledger):
+        """ 読み込んだ ledger を self.ledger とする
+        store がある場合は store に格納し、columnar の場合は各勘定を
+        Columns に、そうでなければ list に変換する """
+        if self._store:
+            self.clear_ledger()
+            for elem in self.ledger.keys():
+                for ac in self.ledger[elem].keys():
+                    self.ledger[elem][ac].extend(ledger[elem][ac])
+            return
+        self._strings = Strings()
+        self.ledger = ledger
+        for elem in self.ledger.keys():
+            for ac in self.ledger[elem].keys():
+                self.ledger[elem][ac] = self._rows(self.ledger[elem][ac])
+
+    def _opening(self):
+        """ init データを期首日の仕訳として返す (_bal は beginning balance) """
+        rslt = []
+        for x in self.initial.keys():
+
+            # 借方科目の場合
+            if x in {"assets", "expenses"}:
+                for y in self.initial[x].keys():
+                    if self.initial[x][y] != 0:
+                        rslt.append((
+                            y, self.initial[x][y],
+                            "_bal", self.initial[x][y], ""
+                        ))
+
+            # 貸方科目の場合
+            else:
+                for y in self.initial[x].keys():
+                    if self.initial[x][y] != 0:
+                        rslt.append((
+                            "_bal", self.initial[x][y],
+                            y, self.initial[x][y], ""
+                        ))
+
+        return rslt
+
+    def _getindex(self, elem, ac):
+        """ (elem, ac) の累積和インデックスを返す
+        ledger の行数が変わっている場合は作り直す
+        (store の勘定は sqlite3 で集計するため、そのまま返す) """
+        rows = self.ledger[elem][ac]
+        if self._store:
+            return rows
+        idx = self._index.get((elem, ac))
+        if idx is None or idx.size != len(rows):
+            idx = _Index(rows)
+            self._index[(elem, ac)] = idx
+        return idx
+
+    def _cached(self, key):
+        """ 期間 key の (tb, fs) をキャッシュから返す
+        ない要素、現在の元帳の版でない場合は None とする """
+        x = self._cache.get(key)
+        if x is None or x[0] != self._version:
+            return None, None
+        self._cache.move_to_end(key)
+        return x[1:]
+
+    def _remember(self, key, tb=None, fs=None):
+        """ 期間 key の tb, fs をキャッシュに加える (None の要素は
+        キャッシュの値のままとする)
+        cachesize を超えた場合は、最も前に参照された期間から削除する """
+        if not self.cachesize:
+            return
+        oldtb, oldfs = self._cached(key)
+        self._cache[key] = (
+            self._version,
+            oldtb if tb is None else tb, oldfs if fs is None else fs
+        )
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cachesize:
+            self._cache.popitem(last=False)
+
+    def _cachekeys(self):
+        """ キャッシュの現在の版の期間の集合 """
+        return {x for x, v in self._cache.items() if v[0] == self._version}
+
+    def _cachekey(self, ledger):
+        """ キャッシュのファイルの照合用に、初期化ファイルと ledger
+        (元帳のファイル) の sha1 を返す """
+        return [filestat(self._inittype[0])[2], filestat(ledger)[2]]
+
+    def _incidence(self):
+        """ fs の各項目 (elem, 項目名) と、その項目に集計される tb の
+        勘定名のリストの組を make と同じ順序で返す
+        各要素の最後の項目は合計 (ELEM) とする """
+        rslt = []
+        for elem, (names, parents) in self._tree.items():
+            for i, x in enumerate(names):
+                rslt.append(((elem, x), [
+                    ac for ac, anc in parents.items() if i in anc
+                ]))
+            rslt.append(((elem, elem.upper()), list(parents.keys())))
+        return rslt
+
+    def _npSpans(self, spans):
+        """ calcSpans の numpy 版
+        日付 × 勘定の日次増減の行列を累積和し、境界日の行を取り出して
+        全期間の試算表を計算する。財務諸表の階層の集計は、勘定 × fs 項目の
+        接続行列との行列積でおこなう """
+
+        one = datetime.timedelta(days=1)
+        keys = [(e, ac) for e in self.initial.keys() for ac in self.initial[e]]
+        idxs = [self._getindex(*x) for x in keys]
+
+        # 日付の範囲 (base からの日数を行番号とする)
+        dates = [y for span in spans.values() for x in span for y in x]
+        for idx in idxs:
+            dates.extend(idx.dates[:1] + idx.dates[-1:])
+            dates.extend(y for x in idx.scheds for y in (x[0], x[4]))
+        base = min(dates).toordinal() - 1
+        n = max(dates).toordinal() - base + 2
+
+        # 通常の行の日次増減 (daily) と schedule 行の日次額の差分 (diff)
+        daily = np.zeros((n, len(keys)), dtype=np.int64)
+        diff = np.zeros((n, len(keys)), dtype=np.int64)
+        for a, idx in enumerate(idxs):
+            if idx.dates:
+                rows = np.fromiter(
+                    (x.toordinal() - base for x in idx.dates),
+                    dtype=np.int64, count=len(idx.dates)
+                )
+                daily[rows, a] = np.diff(np.array(idx.cums, dtype=np.int64))
+            for x in idx.scheds:
+                s, e = x[0].toordinal() - base, x[4].toordinal() - base
+                diff[s, a] += x[2]
+                diff[e, a] += x[5] - x[2]
+                diff[e + 1, a] -= x[5]
+        cums = np.cumsum(daily + np.cumsum(diff, axis=0), axis=0)
+
+        # 勘定 × fs 項目の接続行列
+        pos = {x : i for i, x in enumerate(keys)}
+        items = self._incidence()
+        inc = np.zeros((len(keys), len(items)), dtype=np.int64)
+        for j, ((elem, _), acs) in enumerate(items):
+            for ac in acs:
+                inc[pos[(elem, ac)], j] = 1
+        flow = np.array(
+            [e in ("expenses", "income") for e, _ in keys], dtype=np.int64
+        )
+
+        rslt, tbrow = {}, None
+        for name, span in spans.items():
+            if not span:
+                rslt[name] = {}
+                continue
+
+            # 全期間の試算表 (期間 × 勘定) と財務諸表 (期間 × fs 項目)
+            start = np.array([(x[0] - one).toordinal() - base for x in span])
+            end = np.array([x[1].toordinal() - base for x in span])
+            tb = cums[end] - cums[start] * flow
+            fsmat = tb @ inc
+
+            self.fs = {}
+            for prd, tbrow, fsrow in zip(span, tb.tolist(), fsmat.tolist()):
+                self._tbname = prd
+                fs = self.fs[prd] = self.clear_fs()
+                for ((elem, x), _), v in zip(items, fsrow):
+                    fs[elem][x] = v
+                self._remember(prd, fs=fs)
+            rslt[name] = self.fs
+
+        # self.tb は最後の期間の試算表とする
+        if tbrow is not None:
+            self.clear_tb()
+            for (elem, ac), v in zip(keys, tbrow):
+                self.tb[elem][ac] = v
+        return rslt
+
     def _alignjnl(self, data):
         """ 仕訳データの金額部分について、コメントを除き、整数化する"""
-        for Dname, Damount, Cname, Camount in data:
-            comment = getcmt(Camount) if cmt.search(Camount) else ""
-            Camount = rmcmt(Camount)
-            Damount = int(Damount) if Dname else 0
-            Camount = int(Camount) if Cname else 0
-            Dname, Cname = self._getanm(Dname), self._getanm(Cname)
-            yield Dname, Damount, Cname, Camount, comment
+        return alignjnl(data, self._nestdict)
 
     def _adjentry(self, date, entry):
-        """ journalize に adj=T がついたときの内部関数"""
+        """ journalize に adj=T がついたときの内部関数
+        date から月末までの日割計算を Schedule として date に格納し、
+        その Schedule を返す """
+        x = self._schedule(date, entry)
+        self._inputtodict(date, [x])
+        return x
+
+    def _schedule(self, date, entry):
+        """ entry の date から月末までの日割計算の Schedule を返す """
         maxd = maxday(date)
         days = (maxd - date).days + 1
         Drnum, Crnum = entry[1] // days, entry[3] // days
-        ordentry = [(entry[0], Drnum,
-                     entry[2], Crnum, entry[4])]
-        lastentry = [(entry[0], entry[1] - ((days-1) * Drnum),
-                      entry[2], entry[1] - ((days-1) * Crnum),
-                      entry[4])]
-
-        while date < maxd:
-            self._inputtodict(date, ordentry)
-            date += datetime.timedelta(days=1)
-        else:
-            self._inputtodict(date, lastentry)
+        Dlast = entry[1] - ((days-1) * Drnum)
+        Clast = entry[3] - ((days-1) * Crnum)
+
+        # 1 日のみの場合、開始日の仕訳は最終日の仕訳となる
+        if days == 1:
+            Drnum, Crnum = Dlast, Clast
+
+        return Schedule(
+            entry[0], Drnum, entry[2], Crnum, entry[4], maxd, Dlast, Clast
+        )
+
+    def _checkrow(self, row):
+        """ check の内部関数。csv の 1 行を alignjnl と同様に仕訳に変換する
+        問題がある場合は、その内容 (文字列) を返す """
+        if len(row) != 4:
+            return "Expected 4 fields, found %d" % len(row)
+        for name in (row[0], row[2]):
+            if name and name not in self._nestdict:
+                return "Unknown account " + repr(name)
+        try:
+            return next(alignjnl([row], self._nestdict))
+        except ValueError:
+            return "Invalid amount in " + repr(",".join(row))
 
     def _inputtodict(self, date, entry):
         """ journal dict に entry を入れる内部関数 """
@@ -513,32 +2101,228 @@ class Bkeep:
         # 日付の key に entry を挿入
         self.journal[date].extend(entry)
 
-    def _apply(self, dt, name, contrast, amount, comment):
+    def _manifest(self, inpdict, adjdict, old):
+        """ bk/adj ファイルの一覧 {path : [種類, 日付] + filestat} を返す
+        old (以前の一覧) とサイズ・更新時刻が一致するファイルは
+        ハッシュを計算しない """
+        files = {p : ["bk", dtstr(dt)] for dt, p in inpdict.items()}
+        files.update({p : ["adj", dtstr(dt)] for dt, p in adjdict.items()})
+        return {
+            p : kind + filestat(p, old.get(p, [0, 0])[2:])
+            for p, kind in files.items()
+        }
+
+    def _rebuild(self, inpdict, adjdict, encoding, workers):
+        """ update, refresh の内部関数。全体を仕訳・転記し直し、
+        journal の日付の集合を返す """
+        self.clear_journal()
+        self.journal[self._start] = self._opening()
+        self.clear_ledger()
+        self.journalize(inpdict, encoding=encoding, workers=workers)
+        self.journalize(adjdict, adj=True, encoding=encoding, workers=workers)
+        self.post()
+        return set(self.journal.keys())
+
+    def _refresh(self, inpdict, adjdict, oldfiles, files, encoding, workers):
+        """ update, refresh の内部関数。ファイル一覧 oldfiles と files
+        を内容 (samefile) で比較し、影響を受ける日付のみを再度仕訳・転記する
+        その日付の集合を返す """
+
+        # 影響を受ける日付の抽出
+        affected = set()
+        for p in set(oldfiles) | set(files):
+            if not samefile(oldfiles.get(p), files.get(p)):
+                for x in (oldfiles.get(p), files.get(p)):
+                    if x:
+                        affected.add(strdt(x[1]))
+        if not affected:
+            return affected
+
+        # 影響を受ける日付のファイルのみ再度仕訳する
+        # (adj ファイルの仕訳は、ファイルの日付の Schedule となる)
+        bkdict = {dt : p for dt, p in inpdict.items() if dt in affected}
+        adjs = {dt : p for dt, p in adjdict.items() if dt in affected}
+        # (仕訳に失敗した場合は、journal, ledger を変更しない)
+        keep = self.journal
+        self.journal = {}
+        try:
+            if self._start in affected:
+                self.journal[self._start] = self._opening()
+            self.journalize(bkdict, encoding=encoding, workers=workers)
+            self.journalize(adjs, adj=True, encoding=encoding,
+                            workers=workers)
+            new = {dt : v for dt, v in self.journal.items() if dt in affected}
+        finally:
+            self.journal = keep
+
+        # 仕訳帳の差し替えと再転記 (並べ替えは行の増えた勘定のみ)
+        for dt in affected:
+            if dt in self.journal:
+                del self.journal[dt]
+        self.journal.update(new)
+        self.unpost(affected)
+        if self._store:
+            self.post(new.keys())
+            return affected
+        sizes = {
+            (elem, ac) : len(rows)
+            for elem in self.ledger.keys()
+            for ac, rows in self.ledger[elem].items()
+        }
+        self.post(new.keys())
+        for elem in self.ledger.keys():
+            for ac, rows in self.ledger[elem].items():
+                if len(rows) != sizes[(elem, ac)]:
+                    self._sortrows(rows)
+        return affected
+
+    def _targets(self):
+        """ 勘定名 : (元帳の勘定, 符号, retained に振り替えるか) の dict
+        (self._classes に元帳の勘定を対応させたもの) を返す """
+        return {
+            ac : (self.ledger[elem][ac], sign, pl)
+            for ac, (elem, sign, pl) in self._classes.items()
+        }
+
+    def _postday(self, day, entries, targets):
+        """ self.post の内部関数。1 日分の仕訳 entries を転記し、
+        損益勘定の合計を retained に振り替える
+        targets は self._targets() の返り値 """
+
+        # 損益勘定の初期化 (retained への振替額のリスト)
+        self._incoming = incoming = []
+
+        for x in entries:
+
+            # 日割計算の場合
+            if isinstance(x, Schedule):
+                self._post(day, x)
+                continue
+
+            Dname, Damount, Cname, Camount, comment = x
+
+            # 行の貸借金額が一致するならば対照勘定、
+            # そうでなければ sundry (諸口) とする
+            Dcont = Cname if Damount == Camount else "sundry"
+            Ccont = Dname if Damount == Camount else "sundry"
+
+            # 借方項目の転記 (借方勘定、貸方勘定、借方金額、コメント)
+            if Dname and Dname[0] != "_":
+                rows, sign, pl = targets.get(Dname) or self._unknown(Dname)
+                rows.append([day, Dcont, sign * Damount, comment])
+                if pl and Dcont != "_closing":
+                    incoming.append(-Damount)
+
+            # 貸方項目の転記 (貸方勘定、借方勘定、貸方金額、コメント)
+            if Cname and Cname[0] != "_":
+                rows, sign, pl = targets.get(Cname) or self._unknown(Cname)
+                rows.append([day, Ccont, -sign * Camount, comment])
+                if pl and Ccont != "_closing":
+                    incoming.append(Camount)
+
+        # 損益勘定の剰余金への振り替え
+        if incoming:
+            self.ledger["equity"]["retained"].append(
+                [day, "_incoming", sum(incoming), ""]
+            )
+
+    def _unknown(self, name):
+        """ initial に含まれない勘定科目の場合のエラー """
+        raise ValueError(name + " isn't included in initial data.")
+
+    def _post(self, day, x):
+        """ self.post の内部関数。journal の 1 行を転記する """
+
+        # 行の貸借金額が一致するならば対照勘定、
+        # そうでなければ sundry (諸口) とする
+        Dcont = x[2] if x[1] == x[3] else "sundry"
+        Ccont = x[0] if x[1] == x[3] else "sundry"
+
+        # 日割計算の場合は (終了日, 最終日の金額) を渡す
+        Dsch = (x.end, x.Dlast) if isinstance(x, Schedule) else None
+        Csch = (x.end, -x.Clast) if isinstance(x, Schedule) else None
+
+        # 借方項目の転記 (借方勘定、貸方勘定、借方金額、コメント)
+        self._apply(day, x[0], Dcont, x[1], x[4], Dsch)
+
+        # 貸方項目の転記 (貸方勘定、借方勘定、貸方金額、コメント)
+        self._apply(day, x[2], Ccont, -x[3], x[4], Csch)
+
+    def _apply(self, dt, name, contrast, amount, comment, sched=None):
        """ self.post の内部関数。
        equity の retained (利益剰余金) 勘定に、収益・費用に追加した額
-       を同時に計上する""" 
-
-       Plus = [dt, contrast, amount, comment]
-       PlusE = [dt, name, amount, comment]
-       Minus = [dt, contrast, -amount, comment]
-       MinusE = [dt, name, -amount, comment]
+       を同時に計上する
+       sched=(終了日, 最終日の金額) の場合は schedule 行として転記し、
+       retained にも schedule 行を直接計上する
+       対照勘定が _closing (締切) の場合は retained に計上しない""" 
 
        if not name or name[0] == "_":
+           return
+       elem, sign, pl = self._classes.get(name) or self._unknown(name)
+
+       row = [dt, contrast, sign * amount, comment]
+       if sched:
+           row.extend([sched[0], sign * sched[1]])
+       self.ledger[elem][name].append(row)
+
+       # 収益・費用の場合、retained への振り替え
+       if not pl or contrast == "_closing":
            pass
-       elif name in self.initial["assets"].keys():
-           self.ledger["assets"][name].append(Plus)
-       elif name in self.initial["liabilities"].keys():
-           self.ledger["liabilities"][name].append(Minus)
-       elif name in self.initial["equity"].keys():
-           self.ledger["equity"][name].append(Minus)
-       elif name in self.initial["income"].keys():
-           self.ledger["income"][name].append(Minus)
-           self._incoming.append(MinusE)
-       elif name in self.initial["expenses"].keys():
-           self.ledger["expenses"][name].append(Plus)
-           self._incoming.append(MinusE)
+       elif sched:
+           self.ledger["equity"]["retained"].append(
+               [dt, "_incoming", -amount, "", sched[0], -sched[1]]
+           )
        else:
-           raise ValueError(name + " isn't included in initial data.")
+           self._incoming.append(-amount)
+
+    def _layout(self, fss):
+        """ cat, report の内部関数。fs のリスト fss の全体について、
+        (勘定科目名の幅, 金額の幅, 比率の幅) を返す """
+        n = max(len(x.replace(":", "  ")) for fs in fss
+                for x in self._acquire_keys(fs))
+        m, mp = 5, 0
+        for fs in fss:
+            for x in self._acquire_values(fs):
+                m = max(m, len("{:,d}".format(x)))
+                mp = max(mp, len("{:.2%}".format(x)))
+        return n, m, mp
+
+    def _render(self, fs, layout):
+        """ cat, report の内部関数。1 期間の fs の貸借対照表・損益計算書を
+        layout (_layout の返り値) の幅で、行のリストとして返す """
+
+        n, m, mp = layout
+        total = {x : fs[x][x.upper()] for x in fs.keys()}
+        earn = total["income"] - total["expenses"]
+        epi = earn / total["income"] if total["income"] else 0
+
+        # 費用項目のデフレート
+        # income に唯一の salary が存在するならば、salary をデフレーターにし、
+        # そうでない場合は、収益総額をデフレーターにする
+        namebox = [s for s in fs['income'].keys() if 'salary' in s]
+        exdeflator = fs['income'][namebox[0]] if len(namebox) == 1 else total['income']
+        ratio = lambda x: x / exdeflator if exdeflator else 0
+
+        # assets ~ expenses
+        lines = []
+        for elem in fs.keys():
+            lines.extend([elem.upper(), "============="])
+            if elem == 'expenses':
+                for x in list(fs[elem].items())[:-1]:
+                    lines.append("{:<{}}{:>{},d}{:>{}.2%}".format(x[0].replace(":", "  "), n+1, x[1], m, ratio(x[1]), mp))
+                lines.append("-------------")
+                lines.append("{:<{}}{:>{},d}{:>{}.2%}\n".format("TOTAL", n+1, total[elem], m, ratio(total[elem]), mp))
+            else:
+                for x in list(fs[elem].items())[:-1]:
+                    lines.append("{:<{}}{:>{},d}".format(x[0].replace(":", "  "), n+1, x[1], m))
+                lines.append("-------------")
+                lines.append("{:<{}}{:>{},d}\n".format("TOTAL", n+1, total[elem], m))
+
+        # summary
+        lines.extend(["SUMMARY", "============="])
+        lines.append("{:<{}}{:>{},d}".format("earn", n+1, earn, m))
+        lines.append("{:<{}}{:>{}.2%}".format("epi", n+1, epi, m))
+        return lines
 
     def _makeData(self, start, end, names=False):
         """ 各種 calc のために prepare, make する """
@@ -573,21 +2357,17 @@ class Bkeep:
         return rslt
 
 
-    def _dtfmt(self):
-        """ self.ledger の日付を文字列に変換 """
-        for elem in self.ledger.keys():
-            for ac in self.ledger[elem].keys():
-                for tr in self.ledger[elem][ac]:
-                    if isinstance(tr[0], datetime.date):
-                        tr[0] = dtstr(tr[0])
-
     def _dtparse(self):
         """ self.ledger の日付を datetime.date に変換 """
         for elem in self.ledger.keys():
             for ac in self.ledger[elem].keys():
+                if not isinstance(self.ledger[elem][ac], list):
+                    continue
                 for tr in self.ledger[elem][ac]:
                     if isinstance(tr[0], str):
                         tr[0] = strdt(tr[0])
+                    if len(tr) > 4 and isinstance(tr[4], str):
+                        tr[4] = strdt(tr[4])
 
     def _acquire_keys(self, data):
         """ self.initial から要素・勘定科目名を抽出する関数"""
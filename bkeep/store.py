@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+import sqlite3, datetime
+from functools import lru_cache
+from collections.abc import MutableMapping
+
+###
+###     sqlite3 による journal, ledger の保存先
+###
+
+# 日付は序数 (toordinal) で保存する (同じ序数には同じ datetime.date を返す)
+fromord = lru_cache(maxsize=None)(datetime.date.fromordinal)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    id INTEGER PRIMARY KEY, date INTEGER NOT NULL,
+    Dname TEXT, Damount INTEGER, Cname TEXT, Camount INTEGER, comment TEXT,
+    end INTEGER NOT NULL DEFAULT 0, Dlast INTEGER, Clast INTEGER
+);
+CREATE INDEX IF NOT EXISTS journal_date ON journal (date);
+CREATE TABLE IF NOT EXISTS ledger (
+    id INTEGER PRIMARY KEY, elem TEXT NOT NULL, account TEXT NOT NULL,
+    date INTEGER NOT NULL, contrast TEXT, amount INTEGER NOT NULL,
+    comment TEXT, end INTEGER NOT NULL DEFAULT 0, last INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ledger_account_date ON ledger (elem, account, date);
+"""
+
+# date 以前の合計 (schedule 行は日割額 × 日数 + 最終日の金額)
+UPTO = """
+SELECT COALESCE(SUM(CASE
+    WHEN end = 0 THEN amount
+    WHEN end <= :t THEN (end - date) * amount + last
+    ELSE (:t - date + 1) * amount END), 0)
+FROM ledger WHERE elem = :elem AND account = :account AND date <= :t
+"""
+
+
+class Store:
+    """ journal と ledger を sqlite3 のファイルに保存するクラス
+    (elem, account, date) の索引を持ち、試算表の計算は SUM による
+    範囲の集計として sqlite3 側でおこなう
+    追加された行はバッファに溜め、読み出しの前にまとめて挿入する
+    (commit は journalize, post などの処理の最後に commit でおこなう) """
+
+    def __init__(self, path, schedule=tuple):
+        """ path は sqlite3 のファイル、schedule は journal の
+        日割計算の行を復元するクラス (bkeep.Schedule) """
+        self.path = path
+        self.schedule = schedule
+        self.con = sqlite3.connect(path)
+        self.con.executescript(SCHEMA)
+        self._pending = {"journal" : [], "ledger" : []}
+
+    def flush(self):
+        """ バッファの行をまとめて挿入する """
+        if self._pending["journal"]:
+            self.con.executemany(
+                "INSERT INTO journal (date, Dname, Damount, Cname, Camount, "
+                "comment, end, Dlast, Clast) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._pending["journal"]
+            )
+        if self._pending["ledger"]:
+            self.con.executemany(
+                "INSERT INTO ledger (elem, account, date, contrast, amount, "
+                "comment, end, last) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                self._pending["ledger"]
+            )
+        self._pending = {"journal" : [], "ledger" : []}
+
+    def commit(self):
+        """ バッファの行を挿入し、変更をファイルに確定する """
+        self.flush()
+        self.con.commit()
+
+    def query(self, sql, *args):
+        """ バッファを挿入した上で sql を実行する """
+        self.flush()
+        return self.con.execute(sql, *args)
+
+    def ledger(self, initial, clear=False):
+        """ initial の勘定ごとの Rows からなる ledger を返す
+        clear=True の場合、保存済みの行を削除する """
+        if clear:
+            self.query("DELETE FROM ledger")
+        return {
+            elem : {ac : Rows(self, elem, ac) for ac in initial[elem].keys()}
+            for elem in initial.keys()
+        }
+
+    def journal(self, clear=False):
+        """ Journal を返す (clear=True の場合、保存済みの行を削除する) """
+        if clear:
+            self.query("DELETE FROM journal")
+        return Journal(self)
+
+    def unpost(self, dates):
+        """ dates の日付 (schedule 行は開始日) の ledger の行を削除する """
+        self.query(
+            "DELETE FROM ledger WHERE date IN (%s)" % ",".join("?" * len(dates)),
+            [x.toordinal() for x in dates]
+        )
+
+
+class Rows:
+    """ Store に保存された 1 つの勘定の元帳
+    従来の元帳 (行のリスト) と同様に参照・追加でき、
+    _Index と同じく upto, between, sweep で合計を返す """
+
+    def __init__(self, store, elem, account):
+        self.store, self.elem, self.account = store, elem, account
+
+    def _select(self, sql, *args):
+        return self.store.query(
+            sql + " WHERE elem = ? AND account = ?" + (args[0] if args else ""),
+            (self.elem, self.account) + tuple(args[1:])
+        )
+
+    def __len__(self):
+        return self._select("SELECT COUNT(*) FROM ledger").fetchone()[0]
+
+    def __iter__(self):
+        cur = self._select(
+            "SELECT date, contrast, amount, comment, end, last FROM ledger",
+            " ORDER BY date, id"
+        )
+        for dt, contrast, amount, comment, end, last in cur:
+            row = [fromord(dt), contrast, amount, comment]
+            if end:
+                row.extend([fromord(end), last])
+            yield row
+
+    def __getitem__(self, i):
+        return list(self)[i]
+
+    def append(self, row):
+        """ 行を追加する (バッファに溜める) """
+        sched = len(row) > 4
+        self.store._pending["ledger"].append((
+            self.elem, self.account, row[0].toordinal(), row[1], row[2],
+            row[3], row[4].toordinal() if sched else 0, row[5] if sched else 0
+        ))
+
+    def extend(self, rows):
+        """ 複数の行を追加する """
+        for x in rows:
+            self.append(x)
+
+    def sort(self, key=None, reverse=False):
+        """ 行は常に日付順に読み出されるため、何もしない """
+        pass
+
+    def clear(self):
+        """ 全ての行を削除する """
+        self._select("DELETE FROM ledger")
+
+    def upto(self, end):
+        """ end までの合計 """
+        return self.store.query(UPTO, {
+            "t" : end.toordinal(), "elem" : self.elem, "account" : self.account
+        }).fetchone()[0]
+
+    def between(self, start, end):
+        """ start -- end の合計 """
+        return self.upto(end) - self.upto(start - datetime.timedelta(days=1))
+
+    def sweep(self, points):
+        """ 昇順の日付のリスト points について、各日付までの合計を返す
+        通常の行は日付ごとの合計 (GROUP BY)、schedule 行はそのまま読み出し、
+        日付順に 1 回走査する """
+        daily = self._select(
+            "SELECT date, SUM(amount) FROM ledger",
+            " AND end = 0 GROUP BY date ORDER BY date"
+        ).fetchall()
+        scheds = self._select(
+            "SELECT date, end, amount, last FROM ledger", " AND end > 0"
+        ).fetchall()
+        rslt, i, total = [], 0, 0
+        for t in (x.toordinal() for x in points):
+            while i < len(daily) and daily[i][0] <= t:
+                total += daily[i][1]
+                i += 1
+            rslt.append(total + sum(
+                (e - s) * amount + last if e <= t else (t - s + 1) * amount
+                for s, e, amount, last in scheds if s <= t
+            ))
+        return rslt
+
+    def tojson(self):
+        """ 日付を文字列とした行のリストを返す (json.dump の default 用) """
+        rslt = []
+        for x in self:
+            x[0] = x[0].strftime("%Y%m%d")
+            if len(x) > 4:
+                x[4] = x[4].strftime("%Y%m%d")
+            rslt.append(x)
+        return rslt
+
+
+class Journal(MutableMapping):
+    """ Store に保存された journal ({date : 仕訳のリスト} と同様に扱える)
+    日付の一覧のみをメモリに保持する """
+
+    def __init__(self, store):
+        self.store = store
+        self._days = {
+            fromord(x[0]) for x in
+            store.query("SELECT DISTINCT date FROM journal")
+        }
+
+    def __getitem__(self, date):
+        if date not in self._days:
+            raise KeyError(date)
+        return JournalDay(self.store, date)
+
+    def __setitem__(self, date, entries):
+        self.__delitem__(date)
+        self._days.add(date)
+        JournalDay(self.store, date).extend(entries)
+
+    def __delitem__(self, date):
+        self.store.query(
+            "DELETE FROM journal WHERE date = ?", (date.toordinal(),)
+        )
+        self._days.discard(date)
+
+    def __iter__(self):
+        return iter(sorted(self._days))
+
+    def __len__(self):
+        return len(self._days)
+
+
+class JournalDay:
+    """ Store に保存された 1 日分の仕訳 (リストと同様に参照・追加できる) """
+
+    def __init__(self, store, date):
+        self.store, self.date = store, date
+
+    def __iter__(self):
+        cur = self.store.query(
+            "SELECT Dname, Damount, Cname, Camount, comment, end, Dlast, Clast "
+            "FROM journal WHERE date = ? ORDER BY id", (self.date.toordinal(),)
+        )
+        for x in cur:
+            if x[5]:
+                yield self.store.schedule(*x[:5], fromord(x[5]), *x[6:])
+            else:
+                yield tuple(x[:5])
+
+    def __len__(self):
+        return self.store.query(
+            "SELECT COUNT(*) FROM journal WHERE date = ?",
+            (self.date.toordinal(),)
+        ).fetchone()[0]
+
+    def append(self, x):
+        """ 仕訳を追加する (バッファに溜める) """
+        sched = len(x) > 5
+        self.store._pending["journal"].append((
+            self.date.toordinal(), *x[:5],
+            x[5].toordinal() if sched else 0,
+            x[6] if sched else None, x[7] if sched else None
+        ))
+
+    def extend(self, entries):
+        """ 複数の仕訳を追加する """
+        for x in entries:
+            self.append(x)
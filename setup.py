@@ -10,5 +10,5 @@ setup(
     author="ugos",
     url="https://github.com/python-bkeep/bkeep",
     packages=["bkeep"],
-    scripts=["bin/bkeep"]
+    scripts=["bin/bkeep", "bin/bkeep-bench", "bin/bkeep-batch"]
 )
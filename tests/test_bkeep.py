@@ -0,0 +1,629 @@
+# -*- coding: utf-8 -*-
+
+import os, csv, json, datetime, random
+import pytest
+import bkeep
+from bkeep.bkeep import np
+
+###
+###     テスト用の帳簿
+###
+
+START, END = datetime.date(2024, 1, 1), datetime.date(2024, 3, 31)
+
+# 階層 (food:food のように同じ項目名が重なる勘定を含む)
+INITIAL = {
+    "assets" : {"cash" : 1000, "bank:checking" : 5000, "bank:savings" : 0},
+    "liabilities" : {"card" : 0},
+    "equity" : {"retained" : 6000},
+    "income" : {"salary" : 0, "bonus" : 0},
+    "expenses" : {
+        "food:food" : 0, "food:snack" : 0, "home:rent" : 0,
+        "home:utility:power" : 0, "insurance" : 0
+    }
+}
+
+def mkbook(path):
+    """ path に init.json と 3 か月分の bk ファイル (諸口の行を含む)、
+    月の途中から始まるものを含む adj ファイルを作成する """
+    rnd = random.Random(0)
+    row = lambda Dr, Cr, v: "%s,%d,%s,%d" % (Dr, v, Cr, v)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "init.json"), "w") as wf:
+        json.dump(INITIAL, wf)
+
+    day = START
+    while day <= END:
+        rows = [
+            row("food", "cash", rnd.randint(5, 30)) + " # lunch",
+            row("snack", "card", rnd.randint(1, 9)),
+        ]
+        if day.day == 25:
+            rows.extend(["checking,300,,", ",,salary,250", ",,bonus,50"])
+        if day.day == 10:
+            rows.append(row("savings", "checking", rnd.randint(50, 99)))
+        with open(os.path.join(path, "bk%s.txt" % bkeep.dtstr(day)), "w") as wf:
+            wf.write("\n".join(rows) + "\n")
+        day += datetime.timedelta(days=1)
+
+    adjs = {
+        "adj20240115.txt" : ["rent,3100,checking,3100",
+                             "insurance,100,,", ",,checking,100"],
+        "adj202402.txt" : ["power,290,card,290"],
+        "adj20240310.txt" : ["insurance,77,,", ",,card,77"],
+    }
+    for name, rows in adjs.items():
+        with open(os.path.join(path, name), "w") as wf:
+            wf.write("\n".join(rows) + "\n")
+
+@pytest.fixture
+def book(tmp_path):
+    """ 一時ディレクトリに作成したテスト用の帳簿のパス """
+    path = str(tmp_path / "input")
+    mkbook(path)
+    return path
+
+def build(path, **kwargs):
+    """ path の帳簿を仕訳・転記した Bkeep を返す """
+    bk = bkeep.Bkeep(os.path.join(path, "init.json"), START, **kwargs)
+    bk.journalize(bkeep.pathtract(path, "bk"))
+    bk.journalize(bkeep.pathtract(path, "adj"), adj=True)
+    bk.post()
+    return bk
+
+def spans(bk):
+    """ 月次・週次・日次・移動期間の iter_span_rows の行 """
+    rslt = bk.calcSpans({
+        "Monthly" : bk.mkMonth(START, END),
+        "Weekly" : bk.mkSpan(START, END),
+        "Daily" : bk.mkSpan(START, END, span=1),
+        "Rolling" : bk.mkRolling(START, END, 10, 3),
+    })
+    return {name : list(bk.iter_span_rows(fs)) for name, fs in rslt.items()}
+
+
+###
+###     計算方法・元帳の形式による結果の一致
+###
+
+VARIANTS = {
+    "columnar" : lambda tmp: {"columnar" : True},
+    "store" : lambda tmp: {"store" : str(tmp / "book.db")},
+    "numpy" : lambda tmp: {"engine" : "numpy"},
+    "nocache" : lambda tmp: {"cachesize" : 0},
+}
+
+@pytest.mark.parametrize("variant", list(VARIANTS.keys()))
+def test_variants_match_python(book, tmp_path, variant):
+    """ numpy, columnar, store の結果が通常の計算と一致する """
+    if variant == "numpy" and np is None:
+        pytest.skip("numpy is not installed")
+    expected = spans(build(book))
+    assert spans(build(book, **VARIANTS[variant](tmp_path))) == expected
+
+@pytest.mark.parametrize("ext", ["json", "bkl", "db"])
+def test_ledger_roundtrip(book, tmp_path, ext):
+    """ 保存した元帳を読み込んだ結果が一致する """
+    bk = build(book)
+    path = str(tmp_path / ("ledger." + ext))
+    bk.write_ledger(path)
+    other = bkeep.Bkeep(os.path.join(book, "init.json"), START)
+    other.read_ledger(path)
+    assert spans(other) == spans(bk)
+
+    # 元帳のみのファイルでは期首日の仕訳を保つ
+    assert list(other.journal.keys()) == [START]
+    other.rolling(7, 7)
+    assert list(bk.iter_span_rows(bk.rolling(7, 7, end=END))) == \
+        list(other.iter_span_rows(other.rolling(7, 7, end=END)))
+
+def test_store_reopen(book, tmp_path):
+    """ store の journal, ledger は確定され、別の Bkeep で読み込める """
+    path = str(tmp_path / "book.db")
+    bk = build(book, store=path)
+    other = bkeep.Bkeep(os.path.join(book, "init.json"), START)
+    other.read_ledger(path)
+    assert spans(other) == spans(bk)
+    assert list(other.iter_journal()) == list(bk.iter_journal())
+
+def test_repeated_segment(book):
+    """ food:food の金額は food に 1 度だけ集計される """
+    bk = build(book)
+    bk.prepare(START, END)
+    bk.make()
+    fs = bk.fs[(START, END)]["expenses"]
+    tb = bk.tb["expenses"]
+    assert fs["food"] == tb["food:food"] + tb["food:snack"]
+
+
+###
+###     schedule 行と日ごとの仕訳の一致
+###
+
+def test_schedule_matches_daily(book):
+    """ schedule 行の元帳と、日ごとに展開した仕訳を転記した元帳が一致する """
+    bk = build(book)
+    daily = bkeep.Bkeep(os.path.join(book, "init.json"), START)
+    daily.clear_journal()
+    for day, x in bk.iter_journal():
+        daily._inputtodict(day, [x])
+    daily.post()
+    assert spans(daily) == spans(bk)
+
+    # ledger.json の日ごとの行の合計
+    def sums(rows):
+        rslt = {}
+        for x in rows:
+            rslt[x[0]] = rslt.get(x[0], 0) + x[2]
+        return {dt : v for dt, v in rslt.items() if v}
+    for elem in bk.ledger.keys():
+        if elem == "equity":
+            continue
+        for ac in bk.ledger[elem].keys():
+            rows = bkeep.dailyrows(bk.ledger[elem][ac])
+            assert all(len(x) == 4 for x in rows)
+            assert sums(rows) == sums(daily.ledger[elem][ac])
+
+def test_schedule_amounts(book):
+    """ adj ファイルの各行の日割計算の合計は、記帳された借方・貸方の
+    金額と一致する (諸口の行の貸方は 0 のまま) """
+    bk = bkeep.Bkeep(os.path.join(book, "init.json"), START)
+    adjdict = files(book)[1]
+    bk.journalize(adjdict, adj=True)
+    written, scheds = [], []
+    for day, path in adjdict.items():
+        with open(path) as rf:
+            written.extend(
+                [int(x[1] or 0), int(x[3] or 0)] for x in csv.reader(rf)
+            )
+        scheds.extend((day, x) for x in bk.journal[day])
+    assert [
+        [sum(y[1] for _, y in x.days(day)), sum(y[3] for _, y in x.days(day))]
+        for day, x in scheds
+    ] == written
+
+    # 貸借の一致しない行の日付ごとの差額は、日割額の差と最終日の金額の差
+    with open(os.path.join(book, "adj20240310.txt"), "w") as wf:
+        wf.write("insurance,100,card,60\n")
+    problems = bk.check({}, {datetime.date(2024, 3, 10) :
+                             os.path.join(book, "adj20240310.txt")})
+    assert [x[0] for x in problems[1:]] == ["20240310-20240330", "20240331"]
+    assert [x[2] for x in problems[1:]] == [
+        "Unbalanced by %d" % (100 // 22 - 60 // 22),
+        "Unbalanced by %d" % ((100 - 21 * (100 // 22)) - (60 - 21 * (60 // 22)))
+    ]
+
+
+###
+###     refresh, update と全体の作り直しの一致
+###
+
+def edit(path):
+    """ bk/adj ファイルの追加・変更・削除 """
+    with open(os.path.join(path, "bk20240210.txt"), "a") as wf:
+        wf.write("rent,1234,cash,1234\n")
+    with open(os.path.join(path, "adj20240115.txt"), "w") as wf:
+        wf.write("rent,3300,checking,3300\n")
+    os.remove(os.path.join(path, "bk20240301.txt"))
+    os.remove(os.path.join(path, "adj202402.txt"))
+    with open(os.path.join(path, "bk20240401.txt"), "w") as wf:
+        wf.write("food,12,cash,12\n")
+
+def files(path):
+    """ path の bk, adj ファイルの dict """
+    return bkeep.pathtract(path, "bk"), bkeep.pathtract(path, "adj")
+
+def test_refresh_matches_rebuild(book):
+    """ refresh による再転記の結果が、全体の作り直しと一致する """
+    bk = bkeep.Bkeep(os.path.join(book, "init.json"), START)
+    bk.refresh(*files(book))
+    assert spans(bk) == spans(build(book))
+    edit(book)
+    affected = bk.refresh(*files(book))
+    assert datetime.date(2024, 1, 15) in affected
+    full = build(book)
+    assert spans(bk) == spans(full)
+    assert list(bk.iter_journal()) == list(full.iter_journal())
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_update_matches_rebuild(book, tmp_path, columnar):
+    """ checkpoint を利用した update の結果が、全体の作り直しと一致する """
+    path = str(tmp_path / "checkpoint.json")
+    init = os.path.join(book, "init.json")
+    bkeep.Bkeep(init, START, columnar=columnar).update(*files(book), path)
+    edit(book)
+    bk = bkeep.Bkeep(init, START, columnar=columnar)
+    bk.update(*files(book), path)
+    full = build(book)
+    assert spans(bk) == spans(full)
+    assert list(bk.iter_journal()) == list(full.iter_journal())
+
+    # 変更がない場合は checkpoint のみから復元する
+    bk = bkeep.Bkeep(init, START, columnar=columnar)
+    assert not bk.update(*files(book), path)
+    assert spans(bk) == spans(full)
+
+
+###
+###     複数の帳簿の一括処理
+###
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_batch_reports_failed_books(book, tmp_path, workers):
+    """ 入力が存在しない帳簿は errors に報告し、他の帳簿は処理する """
+    from bkeep import batch
+    manifest = str(tmp_path / "books.json")
+    with open(manifest, "w") as wf:
+        json.dump([
+            {"name" : "good", "input" : book, "output" : "out/good"},
+            {"name" : "bad", "input" : "nope", "output" : "out/bad"},
+            [book, "out/other"],
+        ], wf)
+    summary = str(tmp_path / "summary.csv")
+    errors = batch.run(batch.readmanifest(manifest), summary, workers=workers)
+    assert list(errors.keys()) == ["bad"]
+
+    with open(summary, newline="") as rf:
+        rows = list(csv.reader(rf))
+    assert rows[0] == ["book", "start", "end", "earn", "epi"]
+    assert [x[0] for x in rows[1:]] == ["good"] * 3 + ["input"] * 3
+    assert rows[1:4] == [["good"] + x[1:] for x in rows[4:]]
+    expected = spans(build(book))["Monthly"][1:]
+    assert [[int(x[3]), float(x[4])] for x in rows[1:4]] == \
+        [list(x[2:4]) for x in expected]
+    assert os.path.exists(str(tmp_path / "out" / "good" / "cat.txt"))
+
+
+###
+###     締め切り
+###
+
+def test_close_snapshot(book, tmp_path):
+    """ 締切仕訳を転記した snapshot の収益・費用は 0 となり、
+    現在の元帳は変更しない (date は adj の日割期間の途中) """
+    bk = build(book)
+    before = spans(bk)
+    date = datetime.date(2024, 1, 20)
+    init = bk.close(date, str(tmp_path))
+    assert spans(bk) == before
+
+    tb = bk.balances(date)
+    for elem in init.keys():
+        for ac, v in init[elem].items():
+            flow = elem in ("income", "expenses")
+            assert v == (0 if flow else tb[elem][ac])
+    with open(str(tmp_path / "init20240120.json")) as rf:
+        assert json.load(rf) == init
+
+    ledger, _ = bkeep.loadledger(str(tmp_path / "ledger20240120.bkl"))
+    for elem in ("income", "expenses"):
+        for ac, rows in ledger[elem].items():
+            assert all(x[0] <= date for x in rows)
+            assert sum(bkeep.schedsum(x) for x in rows if len(x) > 4) + \
+                sum(x[2] for x in rows if len(x) == 4) == 0
+    assert ledger["expenses"]["home:rent"]
+
+
+###
+###     計測
+###
+
+@pytest.mark.parametrize("trace", [False, True])
+def test_profiler_nested_stages(book, tmp_path, trace):
+    """ update の内部の段階を呼び出し元の下に記録する """
+    bk = bkeep.Bkeep(os.path.join(book, "init.json"), START)
+    with bkeep.Profiler(bk, trace=trace) as prof:
+        bk.update(*files(book), str(tmp_path / "checkpoint.json"))
+        bk.calcSpans({"Monthly" : bk.mkMonth(START, END)})
+    assert not bk.hooks
+
+    summary = prof.summary()
+    assert list(summary.keys())[:4] == [
+        "update", "update/journalize", "update/post", "update/write_checkpoint"
+    ]
+    assert summary["update/journalize"]["calls"] == 2
+    assert summary["update/journalize"]["depth"] == 1
+    assert summary["calcSpans/make"]["calls"] == 3
+    for path, x in summary.items():
+        assert 0 <= x["self"] <= x["seconds"]
+        assert ("peak_kb" in x) == trace
+    inner = sum(x["seconds"] for k, x in summary.items() if x["depth"] == 1
+                and k.startswith("update/"))
+    assert summary["update"]["seconds"] >= inner
+    if trace:
+        assert summary["update"]["peak_kb"] >= summary["update/post"]["peak_kb"]
+
+    path = str(tmp_path / "profile.txt")
+    prof.cat(path)
+    with open(path) as rf:
+        lines = rf.read().splitlines()
+    assert lines[2].startswith("update ")
+    assert lines[3].startswith("  journalize ")
+
+
+###
+###     bk/adj ファイルの検証
+###
+
+def test_check_reports_all_problems(book):
+    """ 行の形式・勘定科目・金額とファイルごと・日付ごとの貸借の問題を
+    path, 行番号の順にすべて報告する """
+    appends = {
+        "bk20240106.txt" : "food,10,cash,9",
+        "bk20240105.txt" : "food,10,cash,9",
+        "bk20240109.txt" : "food,x,cash,1",
+        "bk20240108.txt" : "nosuch,1,cash,1",
+        "bk20240107.txt" : "food,10",
+    }
+    for name, line in appends.items():
+        with open(os.path.join(book, name), "a") as wf:
+            wf.write(line + "\n")
+    bk = bkeep.Bkeep(os.path.join(book, "init.json"), START)
+    inpdict, adjdict = files(book)
+    problems = bk.check(dict(reversed(list(inpdict.items()))), adjdict)
+
+    path = lambda x: os.path.join(book, x)
+    assert [x[:2] for x in problems] == [
+        (path("bk20240105.txt"), 0), (path("bk20240106.txt"), 0),
+        (path("bk20240107.txt"), 3), (path("bk20240108.txt"), 3),
+        (path("bk20240109.txt"), 3), ("20240105-20240106", 0),
+    ]
+    assert problems[2][2] == "Expected 4 fields, found 2"
+    assert problems[3][2] == "Unknown account 'nosuch'"
+    assert problems[4][2].startswith("Invalid amount")
+    assert problems[5][2] == "Unbalanced by 1"
+
+    # 問題のない帳簿 (諸口の行を含む adj ファイルを含む) は報告しない
+    clean = book + "-clean"
+    mkbook(clean)
+    assert bk.check(*files(clean)) == []
+
+
+###
+###     期間ごとの FS の列指向の保存
+###
+
+@pytest.mark.parametrize("format", ["binary", "npz"])
+def test_spans_roundtrip(book, tmp_path, format):
+    """ dumpspans で保存した列を loadspans で読み込むと、iter_span_rows
+    の行と一致する (file のような列名、拡張子と異なる形式を含む) """
+    if format == "npz" and np is None:
+        pytest.skip("numpy is not installed")
+    bk = build(book)
+    fs = bk.calcSpans({"Monthly" : bk.mkMonth(START, END)})["Monthly"]
+    rows = list(bk.iter_span_rows(fs))
+    path = str(tmp_path / ("fsMonthly." + ("npz" if format == "npz" else "bks")))
+    bk.saveSpan(path, fs=fs)
+
+    def table(cols):
+        names = list(cols.keys())
+        body = [list(x) for x in zip(*(list(cols[x]) for x in names))]
+        for x in body:
+            x[0], x[1] = map(datetime.date.fromordinal, map(int, x[:2]))
+        return [names] + body
+    assert table(bkeep.loadspans(path)) == rows
+    assert table(bkeep.loadspans(path, use_mmap=False)) == rows
+
+    # numpy.savez の引数名と同じ列名、拡張子によらない形式の指定
+    odd = [["start", "end", "earn", "epi", "file", "allow_pickle"],
+           [START, END, 1, 0.5, 2, 3]]
+    path = str(tmp_path / "odd.dat")
+    bkeep.dumpspans(odd, path, format)
+    assert os.listdir(str(tmp_path)).count("odd.dat") == 1
+    assert table(bkeep.loadspans(path, format=format)) == odd
+    with pytest.raises(ValueError):
+        bkeep.dumpspans(odd, path, "csv")
+
+
+###
+###     更新時刻のみ変わったファイル
+###
+
+def touch(path):
+    """ path の内容を変えずに更新時刻を進める """
+    st = os.stat(path)
+    os.utime(path, (st.st_atime + 10, st.st_mtime + 10))
+
+def test_update_ignores_touched_files(book, tmp_path):
+    """ 内容の変わらないファイル (init.json を含む) は再度仕訳・転記しない """
+    path = str(tmp_path / "checkpoint.json")
+    init = os.path.join(book, "init.json")
+    expected = spans(build(book))
+    bkeep.Bkeep(init, START).update(*files(book), path)
+    for name in ("init.json", "bk20240210.txt", "adj20240115.txt"):
+        touch(os.path.join(book, name))
+
+    bk = bkeep.Bkeep(init, START)
+    assert bk.update(*files(book), path) == set()
+    assert spans(bk) == expected
+
+    # 一覧は新しい更新時刻で保存し直す
+    with open(path) as rf:
+        manifest = json.load(rf)
+    name = os.path.join(book, "bk20240210.txt")
+    assert manifest["files"][name][3] == os.stat(name).st_mtime
+    assert bk.refresh(*files(book)) == set()
+    touch(name)
+    assert bk.refresh(*files(book)) == set()
+
+
+###
+###     時点の残高
+###
+
+@pytest.mark.parametrize("kwargs", [{}, {"columnar" : True}, {"store" : True}])
+def test_balance_and_flow(book, tmp_path, kwargs):
+    """ balance, flow は日ごとに展開した元帳の行の合計と一致する
+    (adj の日割期間の途中の日付、省略形の勘定科目名を含む) """
+    if kwargs.get("store"):
+        kwargs = {"store" : str(tmp_path / "book.db")}
+    bk = build(book, **kwargs)
+    ref = build(book)
+    dates = [START, datetime.date(2024, 1, 14), datetime.date(2024, 1, 15),
+             datetime.date(2024, 1, 20), datetime.date(2024, 1, 31),
+             datetime.date(2024, 3, 10), END]
+    for elem in ref.ledger.keys():
+        for ac, rows in ref.ledger[elem].items():
+            rows = bkeep.dailyrows(rows)
+            upto = lambda t: sum(x[2] for x in rows if x[0] <= t)
+            for t in dates:
+                assert bk.balance(ac, t) == upto(t)
+            for s, e in zip(dates, dates[1:]):
+                assert bk.flow(ac, s, e) == \
+                    upto(e) - upto(s - datetime.timedelta(days=1))
+
+    # 省略形の勘定科目名
+    assert bk.balance("checking", END) == bk.balance("bank:checking", END)
+    assert bk.flow("rent", START, END) == 3100
+    assert bk.balance("insurance", datetime.date(2024, 1, 20)) == 6 * 5
+
+
+###
+###     並列の仕訳
+###
+
+def test_parallel_journalize(book, tmp_path):
+    """ workers=2 の仕訳はファイルの順を保ち、逐次の仕訳と一致する """
+    expected = build(book)
+    bk = bkeep.Bkeep(os.path.join(book, "init.json"), START)
+    bk.journalize(bkeep.pathtract(book, "bk"), workers=2)
+    bk.journalize(bkeep.pathtract(book, "adj"), adj=True, workers=2)
+    bk.post()
+    assert list(bk.journal.keys()) == list(expected.journal.keys())
+    assert list(bk.iter_journal()) == list(expected.iter_journal())
+    assert spans(bk) == spans(expected)
+
+    bk = bkeep.Bkeep(os.path.join(book, "init.json"), START)
+    bk.update(*files(book), str(tmp_path / "checkpoint.json"), workers=2)
+    assert spans(bk) == spans(expected)
+
+    # 貸借の一致しないファイルは逐次の場合と同じく ValueError とする
+    with open(os.path.join(book, "bk20240102.txt"), "a") as wf:
+        wf.write("food,1,cash,2\n")
+    bk = bkeep.Bkeep(os.path.join(book, "init.json"), START)
+    with pytest.raises(ValueError):
+        bk.journalize(bkeep.pathtract(book, "bk"), workers=2)
+
+
+###
+###     試算表・財務諸表のキャッシュ
+###
+
+def test_cache_invalidation(book):
+    """ 元帳を変更した後は、キャッシュの期間も計算し直す """
+    bk = build(book, cachesize=2)
+    before = spans(bk)
+    assert spans(bk) == before
+    edit(book)
+    bk.refresh(*files(book))
+    assert spans(bk) == spans(build(book, cachesize=0))
+    assert spans(bk) != before
+    assert len(bk._cache) <= 2
+
+def test_cache_file(book, tmp_path):
+    """ write_cache のファイルは、同じ初期化ファイル・元帳のファイルの
+    場合のみ read_cache で読み込む """
+    init = os.path.join(book, "init.json")
+    ledger, cache = str(tmp_path / "ledger.json"), str(tmp_path / "cache.json")
+    bk = build(book)
+    expected = spans(bk)
+    bk.write_ledger(ledger)
+    bk.write_cache(cache, ledger)
+
+    def load():
+        other = bkeep.Bkeep(init, START)
+        other.read_ledger(ledger)
+        return other, other.read_cache(cache, ledger)
+    other, n = load()
+    assert n == len(bk._cachekeys()) > 0
+    assert spans(other) == expected
+
+    # 期間が増えなければ保存し直さない
+    other, n = load()
+    os.utime(cache, (0, 0))
+    other.prepare(START, datetime.date(2024, 1, 31))
+    other.write_cache(cache, ledger)
+    assert os.stat(cache).st_mtime == 0
+    other.prepare(START, datetime.date(2024, 2, 1))
+    other.write_cache(cache, ledger)
+    assert os.stat(cache).st_mtime > 0
+    assert load()[1] == n + 1
+
+    # 初期化ファイルの更新時刻のみの変更では読み込み、内容や元帳の
+    # ファイルが変わった場合は読み込まない
+    os.utime(init, (0, 0))
+    assert load()[1] == n + 1
+    with open(init, "a") as wf:
+        wf.write("\n")
+    assert load()[1] == 0
+    with open(init, "w") as wf:
+        json.dump(INITIAL, wf)
+    assert load()[1] == n + 1
+    edit(book)
+    build(book).write_ledger(ledger)
+    other, n = load()
+    assert n == 0
+    assert spans(other) == spans(build(book))
+
+    # 読み込んだ後に転記した場合は、読み込んだ期間も計算し直す
+    bk = build(book)
+    bk.write_ledger(ledger)
+    spans(bk)
+    bk.write_cache(cache, ledger)
+    other, n = load()
+    assert n > 0
+    other.journal[END] = [("food:food", 5, "cash", 5, "")]
+    other.post([END])
+    other.prepare(START, END)
+    assert other.tb["expenses"]["food:food"] == \
+        bk.balances(END, START)["expenses"]["food:food"] + 5
+
+
+###
+###     複数期間の財務諸表の出力
+###
+
+def test_report(book, tmp_path):
+    """ report の各期間は cat と同じ項目・金額で、列の幅を揃え、
+    期間の順に見出しを付ける (split, workers, gzip によらず同じ内容) """
+    import gzip
+    bk = build(book)
+    fs = bk.calcSpans({"Monthly" : bk.mkMonth(START, END)})["Monthly"]
+    periods = sorted(fs.keys())
+
+    split = str(tmp_path / "split")
+    os.makedirs(split)
+    names = bk.report(split, fs=fs, split=True, workers=2)
+    assert names == [
+        os.path.join(split, "cat%s-%s.txt" % (bkeep.dtstr(s), bkeep.dtstr(e)))
+        for s, e in periods
+    ]
+    tokens = lambda text: [x.split() for x in text.splitlines()]
+    widths = set()
+    for (s, e), name in zip(periods, names):
+        bk.prepare(s, e)
+        bk.make()
+        single = str(tmp_path / "single.txt")
+        bk.cat(single)
+        with open(single) as rf, open(name) as rf2:
+            text = rf2.read()
+            assert tokens(text) == tokens(rf.read())
+        # (SUMMARY の earn, epi は cat と同じく金額の列の幅を超えうる)
+        body = text[:text.index("SUMMARY")].splitlines()
+        widths.add(tuple(len(x) for x in body))
+    assert len(widths) == 1
+
+    path = str(tmp_path / "report.txt")
+    assert bk.report(path, fs=fs) == [path]
+    bk.report(path + ".gz", fs=fs, workers=2)
+    with open(path) as rf, gzip.open(path + ".gz", "rt") as rf2:
+        text = rf.read()
+        assert rf2.read() == text
+    heads = [x for x in text.splitlines() if " ~ " in x]
+    assert heads == [
+        "%s ~ %s" % (s.strftime("%Y-%m-%d"), e.strftime("%Y-%m-%d"))
+        for s, e in periods
+    ]
+    for name in names:
+        with open(name) as rf:
+            assert rf.read() in text